@@ -1,5 +1,5 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, Body, Query, Header, Request
+from fastapi import FastAPI, HTTPException, Body, Query, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from aiogram import Bot
@@ -8,13 +8,20 @@ from aiogram.types import Update
 from dotenv import load_dotenv
 import os
 import json
-import aiohttp
-import time  # ← добавлено для кулдауна
-from database import async_session, get_user, update_steam
+import time
+from database import async_session, get_user, update_steam, get_received_items
 from cache import cache
+from xpanda import xpanda, XpandaError
+from ttl_cache import AsyncTTLCache
+from purchases import purchase_workers
+from update_queue import UpdateQueue
+from update_dedupe import create_dedupe
+from notifier import notifier
+from config import bot_session
+from ttl_store import create_ttl_store
+from metrics import registry, api_items_seconds, webhook_update_seconds, invoices_total
 from bot import dp  # dp из bot.py
 from database import add_user
-from config import OWNER_ID
 
 load_dotenv()
 
@@ -27,36 +34,41 @@ if not BOT_TOKEN:
 if not XPANDA_API_KEY:
     raise RuntimeError("XPANDA_API_KEY не найден в .env")
 
-bot = Bot(token=BOT_TOKEN)
+bot = Bot(token=BOT_TOKEN, session=bot_session())
 
-XPANDA_BASE_URL = "https://p2p.xpanda.pro/api/v1"
+# WEBHOOK_QUEUE=1 — webhook сразу отвечает 200, апдейты обрабатывают фоновые воркеры
+update_queue = UpdateQueue(dp, bot)
 
-xpanda_headers = {
-    "Authorization": XPANDA_API_KEY,
-    "Content-Type": "application/json"
-}
+# Повторные доставки одного update_id не обрабатываются дважды
+update_dedupe = create_dedupe()
 
-# Глобальный кулдаун по item_id (60 секунд между созданием инвойсов для одного предмета)
-item_cooldowns = {}  # {item_id: timestamp последнего создания инвойса}
+# Глобальный кулдаун по item_id (60 секунд между созданием инвойсов для одного предмета);
+# TTL_STORE=postgres — общий для всех воркеров
+ITEM_COOLDOWN = int(os.getenv("ITEM_COOLDOWN", 60))
+cooldowns = create_ttl_store()
 
 
-async def get_fresh_price(product_id: str):
-    url = f"{XPANDA_BASE_URL}/items/prices/"
-    params = {"names[]": product_id}
+# Свежие цены по product_id: несколько секунд свежести, одновременные запросы — один вызов Xpanda
+fresh_prices = AsyncTTLCache(
+    ttl=float(os.getenv("FRESH_PRICE_TTL", 3)),
+    maxsize=int(os.getenv("FRESH_PRICE_CACHE_SIZE", 1024))
+)
+
+
+async def _load_fresh_price(product_id: str):
+    items = await xpanda.get_prices(names=[product_id])
+    for item in items:
+        if item.get("n") == product_id:
+            return item.get("p", 0), item.get("q", 0)
+    return None, None
 
+
+async def get_fresh_price(product_id: str):
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=xpanda_headers, params=params, timeout=10) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    items = data.get("items", [])
-                    for item in items:
-                        if item.get("n") == product_id:
-                            return item.get("p", 0), item.get("q", 0)
-                    return None, None
-                else:
-                    print(f"[FRESH PRICE] Ошибка {resp.status}")
-                    return None, None
+        return await fresh_prices.get(product_id, lambda: _load_fresh_price(product_id))
+    except XpandaError as e:
+        print(f"[FRESH PRICE] Ошибка {e.status}")
+        return None, None
     except Exception as e:
         print(f"[FRESH PRICE ERROR] {type(e).__name__}: {str(e)}")
         return None, None
@@ -70,6 +82,11 @@ async def lifespan(app: FastAPI):
 
     webhook_url = f"https://{domain}/webhook"
 
+    notifier.start()
+    await xpanda.start()
+    purchase_workers.start()
+    update_queue.start()
+
     try:
         await bot.set_webhook(
             url=webhook_url,
@@ -77,20 +94,25 @@ async def lifespan(app: FastAPI):
             drop_pending_updates=True
         )
         print(f"Webhook успешно установлен: {webhook_url}")
-        await bot.send_message(OWNER_ID,f"🚀 Сервер запущен\nWebhook: {webhook_url}")  # ← новое
+        notifier.notify(f"🚀 Сервер запущен\nWebhook: {webhook_url}")
     except Exception as e:
         print(f"Ошибка установки webhook: {str(e)}")
-        await bot.send_message(OWNER_ID,f"❌ Ошибка установки webhook:\n{str(e)}")  # ← новое
+        notifier.notify(f"❌ Ошибка установки webhook:\n{str(e)}")
 
     yield
 
     try:
         await bot.delete_webhook(drop_pending_updates=True)
         print("Webhook удалён")
-        await bot.send_message(OWNER_ID,"🛑 Сервер остановлен, webhook удалён")  # ← новое
+        notifier.notify("🛑 Сервер остановлен, webhook удалён")
     except Exception as e:
         print(f"Ошибка удаления webhook: {str(e)}")
-        await bot.send_message(OWNER_ID,f"❌ Ошибка удаления webhook:\n{str(e)}")
+        notifier.notify(f"❌ Ошибка удаления webhook:\n{str(e)}")
+
+    await update_queue.stop()
+    await purchase_workers.stop()
+    await xpanda.close()
+    await notifier.stop()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -115,12 +137,42 @@ async def telegram_webhook(
     if x_telegram_bot_api_secret_token != WEBHOOK_SECRET:
         raise HTTPException(status_code=403, detail="Invalid secret token")
 
-    await dp.feed_update(bot, update)
+    if await update_dedupe.seen(update.update_id):
+        print(f"[WEBHOOK] Повторная доставка update_id={update.update_id} — пропускаем")
+        return {"ok": True}
+
+    if update_queue.enabled:
+        if not update_queue.put(update):
+            await update_dedupe.forget(update.update_id)
+            raise HTTPException(status_code=503, detail="Очередь апдейтов переполнена")
+        return {"ok": True}
+
+    try:
+        with webhook_update_seconds.time(type=update.event_type):
+            await dp.feed_update(bot, update)
+    except Exception:
+        # Telegram повторит апдейт после 500 — повтор не должен считаться дублем
+        await update_dedupe.forget(update.update_id)
+        raise
     return {"ok": True}
 
 
+@app.get("/api/webhook_stats")
+async def get_webhook_stats():
+    return {**update_queue.stats(), "dedupe": update_dedupe.stats()}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/api/profile/{telegram_id}")
-async def get_profile(telegram_id: int):
+async def get_profile(
+    telegram_id: int,
+    items_limit: int = Query(20, ge=1, le=100),
+    items_before: int | None = Query(None)
+):
     user = await get_user(telegram_id)
     if not user:
         raise HTTPException(
@@ -128,10 +180,11 @@ async def get_profile(telegram_id: int):
             detail="Пользователь не найден. Напишите боту /start, чтобы зарегистрироваться."
         )
     
-    items = json.loads(user.items_received) if user.items_received else []
+    items, items_next = await get_received_items(telegram_id, items_limit, items_before)
     return {
         "referrals": user.referrals,
         "items": items,
+        "items_next": items_next,
         "steam_profile": user.steam_profile,
         "trade_link": user.trade_link,
         "has_gift": user.has_gift
@@ -155,40 +208,46 @@ async def get_items(
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=5, le=100),
     search: str = Query(""),
-    balance_check: bool = Query(False)
+    balance_check: bool = Query(False),
+    if_none_match: str = Header(default=None, alias="If-None-Match")
 ):
-    if not cache.all_items:
-        return {"items": [], "total": 0, "page": page, "pages": 1, "message": "Кэш ещё не загружен"}
+    started = time.perf_counter()
+    status = "200"
+    try:
+        snapshot = cache.snapshot  # один снимок на весь запрос, даже если кэш обновится
+        if not len(snapshot):
+            status = "empty"
+            return {"items": [], "total": 0, "page": page, "pages": 1, "message": "Кэш ещё не загружен"}
 
-    filtered = cache.all_items
-    if search.strip():
-        search_lower = search.lower().strip()
-        filtered = [item for item in cache.all_items if search_lower in item["name"].lower()]
+        available_balance = cache.balance.get("available", 0)
 
-    if balance_check:
-        available = cache.balance.get("available", 0)
-        if available > 0:
-            filtered = [item for item in filtered if item.get("price_rub", 0) <= available]
-        else:
-            filtered = [item for item in filtered if item.get("price_rub", 0) == 0]
+        # Тело ответа определяется снимком, балансом и параметрами запроса,
+        # поэтому клиент с актуальным ETag получает 304 без тела
+        etag = snapshot.etag(available_balance)
+        if if_none_match and etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+            status = "304"
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
 
-    start = (page - 1) * limit
-    paginated = filtered[start:start + limit]
+        positions = None  # None — весь каталог без фильтров
+        if search.strip():
+            positions = snapshot.find(search.lower().strip())
 
-    for item in paginated:
-        item["product_id"] = item.get("product_id", item["name"])
+        if balance_check:
+            positions = snapshot.affordable(available_balance, positions)
 
-    total = len(filtered)
-    pages = (total + limit - 1) // limit if limit > 0 else 1
+        # Страницы без поиска повторяются у всех пользователей — их тело кэшируется в снимке
+        cache_key = None if search.strip() else (balance_check,)
+        body = snapshot.encode_page(positions, page, limit, available_balance, cache_key)
+        return Response(content=body, media_type="application/json",
+                        headers={"ETag": etag, "Cache-Control": "no-cache"})
+    finally:
+        api_items_seconds.observe(time.perf_counter() - started, search=str(bool(search.strip())).lower(),
+                                  balance_check=str(balance_check).lower(), status=status)
 
-    return {
-        "items": paginated,
-        "total": total,
-        "page": page,
-        "pages": pages,
-        "cache_timestamp": cache.cache_timestamp.isoformat() if cache.cache_timestamp else None,
-        "available_balance": cache.balance.get("available", 0)
-    }
+
+@app.get("/api/cache_status")
+async def get_cache_status():
+    return cache.status()
 
 
 @app.get("/api/balance")
@@ -208,6 +267,11 @@ async def get_item_price(product_id: str = Query(...)):
     return {"price_rub": fresh_rub, "quantity": fresh_qty}
 
 
+@app.get("/api/item_price/stats")
+async def get_item_price_stats():
+    return fresh_prices.stats()
+
+
 @app.post("/api/create_invoice")
 async def create_invoice(data: dict):
     print("[DEBUG INVOICE] Полученные данные:", data)
@@ -225,21 +289,37 @@ async def create_invoice(data: dict):
 
     if missing:
         print("[DEBUG INVOICE] Отсутствуют поля:", missing)
+        invoices_total.inc(result="bad_request")
         raise HTTPException(status_code=400, detail=f"Missing required fields: {', '.join(missing)}")
 
-    user = await get_user(user_id)
+    # Предмет и цена проверяются по текущему снимку, а не берутся с клиента
+    try:
+        item = cache.get_item(int(item_id))
+    except (TypeError, ValueError):
+        item = None
+    if item is None or item["product_id"] != product_id:
+        invoices_total.inc(result="not_found")
+        raise HTTPException(status_code=404, detail="Предмет не найден или снят с продажи. Обновите список.")
+    if item["price_stars"] != price_stars:
+        invoices_total.inc(result="price_changed")
+        raise HTTPException(status_code=409, detail="Цена предмета изменилась. Обновите список.")
+
+    user = await get_user(user_id, fresh=True)
     if not user:
+        invoices_total.inc(result="no_user")
         raise HTTPException(status_code=404, detail="User not found")
     if not user.trade_link:
+        invoices_total.inc(result="no_trade_link")
         raise HTTPException(status_code=400, detail="Trade link не привязан. Привяжите trade link в профиле перед покупкой.")
 
-    # Глобальный кулдаун по item_id (60 секунд)
-    now = time.time()
-    last_time = item_cooldowns.get(item_id, 0)
-    if now - last_time < 60:
+    # Глобальный кулдаун по item_id: ключ занимается до создания инвойса,
+    # чтобы два одновременных запроса не прошли проверку оба
+    cooldown_key = f"invoice:{item['id']}"
+    if not await cooldowns.acquire(cooldown_key, ITEM_COOLDOWN):
+        invoices_total.inc(result="cooldown")
         raise HTTPException(status_code=429, detail="Предмет временно недоступен. Повторите попытку позже.")
 
-    item_name = f"Предмет ID {item_id}"
+    item_name = item["name"]
 
     try:
         invoice_link = await bot(CreateInvoiceLink(
@@ -248,16 +328,17 @@ async def create_invoice(data: dict):
             payload=json.dumps({"item_id": item_id, "product_id": product_id, "user_id": user_id}),
             provider_token="",
             currency="XTR",
-            prices=[{"label": item_name, "amount": price_stars}]
+            prices=[{"label": item_name, "amount": item["price_stars"]}]
         ))
 
-        # Обновляем кулдаун после успешного создания инвойса
-        item_cooldowns[item_id] = now
-
+        invoices_total.inc(result="created")
         return {"invoice_link": invoice_link}
     except Exception as e:
+        invoices_total.inc(result="error")
+        # инвойс не создан — кулдаун снимается, как будто запроса не было
+        await cooldowns.release(cooldown_key)
         print("[ERROR INVOICE] Telegram API error:", str(e))
-        await bot.send_message(OWNER_ID,f"❌ Ошибка создания инвойса\nUser: {user_id}\nItem ID: {item_id}\nОшибка: {str(e)}")
+        notifier.notify(f"❌ Ошибка создания инвойса\nUser: {user_id}\nItem ID: {item_id}\nОшибка: {str(e)}", "invoice")
         raise HTTPException(status_code=500, detail=f"Telegram invoice error: {str(e)}")
 
 
@@ -273,26 +354,13 @@ async def create_deal(data: dict):
     if not user or not user.trade_link:
         raise HTTPException(status_code=400, detail="Trade link not set in profile")
 
-    payload = {
-        "item_id": item_id,
-        "trade_url": user.trade_link
-    }
-
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(
-                f"{XPANDA_BASE_URL}/deals",
-                json=payload,
-                headers=xpanda_headers,
-                timeout=20
-            ) as resp:
-                if resp.status in [200, 201]:
-                    result = await resp.json()
-                    deal_id = result.get('id') or result.get('deal_id')
-                    return {"status": "success", "deal_id": deal_id}
-                else:
-                    error_text = await resp.text()
-                    raise HTTPException(status_code=502, detail=f"Xpanda error {resp.status}: {error_text}")
-        except Exception as e:
-            await bot.send_message(OWNER_ID,f"❌ Ошибка создания сделки XPANDA\nUser: {user_id}\nItem ID: {item_id}\nОшибка: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Deal creation failed: {str(e)}")
\ No newline at end of file
+    try:
+        result = await xpanda.create_deal(item_id, user.trade_link)
+        deal_id = result.get('id') or result.get('deal_id')
+        return {"status": "success", "deal_id": deal_id}
+    except XpandaError as e:
+        notifier.notify(f"❌ Ошибка создания сделки XPANDA\nUser: {user_id}\nItem ID: {item_id}\nОшибка: {str(e)}", "deal")
+        raise HTTPException(status_code=502, detail=f"Xpanda error {e.status}: {e.text}")
+    except Exception as e:
+        notifier.notify(f"❌ Ошибка создания сделки XPANDA\nUser: {user_id}\nItem ID: {item_id}\nОшибка: {str(e)}", "deal")
+        raise HTTPException(status_code=500, detail=f"Deal creation failed: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,99 @@
+# bench_columnar.py — память и скорость фильтров: список словарей против колонок снимка
+#
+# Запуск: python benchmarks/bench_columnar.py [--items 200000]
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from catalog import CatalogSnapshot, SnapshotBuilder, _fresh_search, item_id_for  # noqa: E402
+from image_index import placeholder_image  # noqa: E402
+from synthetic import make_raw_prices  # noqa: E402
+
+
+def legacy_items(records, stars_rate=45):
+    """Прежний формат кэша: словарь из восьми ключей на предмет"""
+    result = []
+    for item in records:
+        name, price_rub, quantity = item.get("n"), item.get("p", 0), item.get("q", 0)
+        if not name or price_rub <= 0:
+            continue
+        result.append({
+            "id": item_id_for(name),
+            "product_id": name,
+            "name": name,
+            "price_stars": max(1, int(price_rub / 1000 * stars_rate)),
+            "price_usd": round(price_rub / 1000, 2),
+            "price_rub": price_rub,
+            "image": placeholder_image(name),
+            "quantity": quantity
+        })
+    return result
+
+
+def traced(build):
+    """(результат, МБ, удерживаемые результатом)"""
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current / 1024 / 1024
+
+
+def timed(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    # Записи прайса приходят из сети: их строки не должны попадать в замер
+    records = [{"n": r["n"].encode().decode(), "p": r["p"], "q": r["q"]} for r in make_raw_prices(args.items)]
+
+    items, dicts_mb = traced(lambda: legacy_items([dict(r, n=r["n"].encode().decode()) for r in records]))
+
+    def build_snapshot():
+        builder = SnapshotBuilder(CatalogSnapshot.empty(), placeholder_image)
+        for record in records:
+            builder.feed(dict(record, n=record["n"].encode().decode()))
+        return builder.finish()
+
+    snapshot, snapshot_mb = traced(build_snapshot)
+    index_mb = traced(lambda: _fresh_search(snapshot.names))[1]
+    assert snapshot.items == items
+
+    print(f"items={len(items)}")
+    print(f"list of dicts:               {dicts_mb:8.1f} MB")
+    print(f"columnar snapshot (total):   {snapshot_mb:8.1f} MB")
+    print(f"  of which search index:     {index_mb:8.1f} MB")
+    print(f"  columns + price order:     {snapshot_mb - index_mb:8.1f} MB")
+
+    available = sorted(item["price_rub"] for item in items)[len(items) // 2]
+    print(f"\nfilter price_rub <= {available} ({len(snapshot.affordable(available))} hits), ms per call:")
+    print(f"dicts, list comprehension:   {timed(lambda: [i for i in items if i['price_rub'] <= available], args.repeat):8.2f}")
+    print(f"column scan:                 "
+          f"{timed(lambda: [i for i, p in enumerate(snapshot.price_rub) if p <= available], args.repeat):8.2f}")
+
+    def uncached():
+        snapshot._affordable = (None, None)
+        snapshot.affordable(available)
+    print(f"bisect + mask, new cutoff:   {timed(uncached, args.repeat):8.2f}")
+    snapshot.affordable(available)
+    print(f"bisect, cached cutoff:       {timed(lambda: snapshot.affordable(available), args.repeat):8.4f}")
+    print(f"page of 20 (dicts -> JSON):  "
+          f"{timed(lambda: snapshot.encode_page(snapshot.affordable(available), 7, 20, available), args.repeat):8.4f}")
+
+
+if __name__ == "__main__":
+    main()
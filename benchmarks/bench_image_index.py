@@ -0,0 +1,118 @@
+# bench_image_index.py — сравнение старого линейного get_skin_image и ImageIndex
+#
+# Запуск: python benchmarks/bench_image_index.py [--items 5000] [--skins 2000] ...
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from image_index import ImageIndex  # noqa: E402
+from synthetic import SYLLABLES, WEAPONS, WEARS  # noqa: E402
+
+
+def _word(rnd):
+    return "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(1, 3))).title()
+
+
+def make_catalogs(rnd, skins_count, crates_count, stickers_count):
+    skins = []
+    for i in range(skins_count):
+        name = f"{rnd.choice(WEAPONS)} | {_word(rnd)} {i}"
+        skins.append({"name": name, "market_hash_name": name, "image": f"https://img/skin/{i}.png"})
+    crates = [{"name": f"{_word(rnd)} Case {i}", "image": f"https://img/crate/{i}.png"}
+              for i in range(crates_count)]
+    stickers = [{"name": f"Sticker | {_word(rnd)} {i}", "image": f"https://img/sticker/{i}.png"}
+                for i in range(stickers_count)]
+    return skins, crates, stickers
+
+
+def make_market_names(rnd, skins, crates, stickers, count):
+    names = []
+    for _ in range(count):
+        kind = rnd.random()
+        if kind < 0.6:
+            base = rnd.choice(skins)["name"]
+            prefix = rnd.choice(["", "", "StatTrak™ ", "Souvenir "])
+            names.append(f"{prefix}{base} ({rnd.choice(WEARS)})")
+        elif kind < 0.75:
+            names.append(rnd.choice(crates)["name"])
+        elif kind < 0.95:
+            names.append(rnd.choice(stickers)["name"])
+        else:
+            names.append(f"Unknown {_word(rnd)} {rnd.randint(0, 10**6)}")
+    return names
+
+
+def legacy_get_skin_image(skins_data, crates_data, stickers_data, name):
+    """Копия прежней реализации ItemsCache.get_skin_image"""
+    name_lower = name.lower().strip()
+    cleaned_name = name_lower.replace('stattrak™ ', '').split('(')[0].strip()
+    cleaned_name = cleaned_name.replace('souvenir ', '').split('(')[0].strip()
+
+    for skin in skins_data:
+        if cleaned_name in skin.get('name', '').lower() or cleaned_name in skin.get('market_hash_name', '').lower():
+            if img := skin.get('image'):
+                return img
+
+    for crate in crates_data:
+        if name_lower == crate.get('name', '').lower() or cleaned_name in crate.get('name', '').lower():
+            if img := crate.get('image'):
+                return img
+
+    for sticker in stickers_data:
+        if cleaned_name in sticker.get('name', '').lower() or name_lower in sticker.get('name', '').lower():
+            if img := sticker.get('image'):
+                return img
+
+    return f"https://via.placeholder.com/80x60?text={name[:20].replace(' ', '+')}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--skins", type=int, default=2000)
+    parser.add_argument("--crates", type=int, default=500)
+    parser.add_argument("--stickers", type=int, default=8000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    skins, crates, stickers = make_catalogs(rnd, args.skins, args.crates, args.stickers)
+    names = make_market_names(rnd, skins, crates, stickers, args.items)
+
+    started = time.perf_counter()
+    legacy = [legacy_get_skin_image(skins, crates, stickers, name) for name in names]
+    legacy_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index = ImageIndex(skins, crates, stickers)
+    build_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    cold = [index.lookup(name) for name in names]
+    cold_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    warm = [index.lookup(name) for name in names]
+    warm_time = time.perf_counter() - started
+
+    if legacy != cold or cold != warm:
+        mismatches = sum(1 for a, b in zip(legacy, cold) if a != b)
+        print(f"РАСХОЖДЕНИЕ результатов: {mismatches} из {len(names)}")
+        sys.exit(1)
+
+    print(f"items={args.items} skins={args.skins} crates={args.crates} stickers={args.stickers}")
+    print(f"legacy refresh:        {legacy_time * 1000:10.1f} ms")
+    print(f"index build:           {build_time * 1000:10.1f} ms")
+    print(f"index refresh (cold):  {cold_time * 1000:10.1f} ms")
+    print(f"index refresh (warm):  {warm_time * 1000:10.1f} ms")
+    print(f"speedup (cold+build):  {legacy_time / (cold_time + build_time):10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# bench_search_index.py — поиск /api/items: линейный проход против n-граммного индекса
+#
+# Запуск: python benchmarks/bench_search_index.py [--items 50000]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import make_items, make_snapshot  # noqa: E402
+
+QUERIES = ["ak-47", "redline", "fade", "★ karambit", "stattrak™ awp", "#123",
+           "dragon lore", "minimal wear", "ice", "zzz-not-found", "a", "p9"]
+
+
+def linear_search(items, query):
+    """Прежняя фильтрация из get_items"""
+    return [item for item in items if query in item["name"].lower()]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    items = make_items(args.items)
+
+    started = time.perf_counter()
+    snapshot = make_snapshot(args.items)
+    build_time = time.perf_counter() - started
+
+    print(f"items={args.items} snapshot build: {build_time * 1000:.1f} ms")
+    print(f"{'query':<16}{'hits':>8}{'linear ms':>12}{'index ms':>12}{'speedup':>10}")
+    for query in QUERIES:
+        expected = linear_search(items, query)
+        found = snapshot.search(query)
+        if expected != found:
+            print(f"РАСХОЖДЕНИЕ для {query!r}: {len(expected)} != {len(found)}")
+            sys.exit(1)
+
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            linear_search(items, query)
+        linear_time = (time.perf_counter() - started) / args.repeat
+
+        # /api/items берёт позиции, а словари собирает только для страницы
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            snapshot.find(query)
+        index_time = (time.perf_counter() - started) / args.repeat
+
+        print(f"{query:<16}{len(found):>8}{linear_time * 1000:>12.2f}{index_time * 1000:>12.3f}"
+              f"{linear_time / max(index_time, 1e-9):>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# bench_stream_parse.py — пиковая память и время обновления кэша: поток против буфера
+#
+# Запуск: python benchmarks/bench_stream_parse.py [--items 200000] [--payload prices.json]
+#
+# --payload — записанный ответ /items/prices/; без него генерируется синтетический.
+# Каждый режим запускается в отдельном процессе, чтобы ru_maxrss не смешивался.
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _traced_peak_mb(mode: str, payload: str) -> tuple[float, float]:
+    """(пик, остаток после обновления) по tracemalloc — без шума от интерпретатора"""
+    import tracemalloc
+    tracemalloc.start()
+    snapshot = _refresh(mode, payload)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del snapshot
+    return peak / 1024 / 1024, current / 1024 / 1024
+
+
+def _refresh(mode: str, payload: str):
+    from catalog import CatalogSnapshot, SnapshotBuilder
+    from json_stream import ItemsArrayParser
+
+    builder = SnapshotBuilder(CatalogSnapshot.empty(), lambda name: "")
+    with open(payload, "rb") as f:
+        if mode == "buffered":
+            # как resp.json() в ItemsCache.update(): всё тело, всё дерево объектов,
+            # и список записей жив, пока строится снимок
+            items_list = json.loads(f.read()).get("items", [])
+            for record in items_list:
+                builder.feed(record)
+            return builder.finish()
+
+        parser = ItemsArrayParser()
+        while chunk := f.read(CHUNK_SIZE):
+            for record in parser.feed(chunk):
+                builder.feed(record)
+        parser.close()
+    return builder.finish()
+
+
+def run_mode(mode: str, payload: str):
+    import catalog, json_stream  # noqa: F401 — импорт не должен попасть в замер
+
+    baseline = _rss_mb()
+    started = time.perf_counter()
+    snapshot = _refresh(mode, payload)
+    elapsed = time.perf_counter() - started
+    peak_rss = _rss_mb()
+    items = len(snapshot)
+    del snapshot
+
+    traced_peak, traced_retained = _traced_peak_mb(mode, payload)
+    print(json.dumps({
+        "mode": mode,
+        "items": items,
+        "seconds": round(elapsed, 3),
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(peak_rss, 1),
+        "traced_peak_mb": round(traced_peak, 1),
+        "traced_retained_mb": round(traced_retained, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=200_000)
+    parser.add_argument("--payload")
+    parser.add_argument("--mode", choices=["stream", "buffered"])
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.payload)
+        return
+
+    payload = args.payload
+    if payload is None:
+        from synthetic import make_raw_prices
+        fd, payload = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"items": make_raw_prices(args.items), "count": args.items}, f, ensure_ascii=False)
+
+    print(f"payload: {payload} ({os.path.getsize(payload) / 1024 / 1024:.1f} MB)")
+    try:
+        for mode in ("buffered", "stream"):
+            out = subprocess.run([sys.executable, __file__, "--mode", mode, "--payload", payload],
+                                 check=True, capture_output=True, text=True).stdout
+            result = json.loads(out)
+            print(f"{mode:<9} items={result['items']} time={result['seconds']:.2f}s "
+                  f"peak RSS={result['peak_rss_mb']:.0f} MB "
+                  f"(+{result['peak_rss_mb'] - result['baseline_rss_mb']:.0f} MB over baseline); "
+                  f"python heap peak={result['traced_peak_mb']:.0f} MB, "
+                  f"snapshot={result['traced_retained_mb']:.0f} MB")
+    finally:
+        if args.payload is None:
+            os.unlink(payload)
+
+
+if __name__ == "__main__":
+    main()
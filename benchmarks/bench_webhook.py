@@ -0,0 +1,322 @@
+# bench_webhook.py — нагрузка на /webhook -> dp.feed_update синтетическими апдейтами Telegram
+#
+# Запуск: python benchmarks/bench_webhook.py [--rate 20] [--rate-factor 1.5] [--max-p99 500]
+#         [--queue] [--database-url postgresql+asyncpg://.../bench_db] [--output run.json]
+#
+# Bot API и Xpanda — заглушка standin.py. База по умолчанию — временный файл
+# SQLite (нужен пакет aiosqlite); для цифр, близких к проду, — отдельная база
+# PostgreSQL через --database-url. Нагрузка открытая: апдейты идут с заданной
+# частотой, которая растёт ступенями, пока p99 или доля ошибок не превысят
+# порог. Покупки только ставятся в очередь — воркеры purchases не запускаются.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import redirect_stdout
+from datetime import datetime
+from itertools import count
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_service import (BENCH_USER_BASE, asgi_request, configure_service, create_bench_users,  # noqa: E402
+                           git_revision, reset_bench_users, summarize)
+from standin import Standin  # noqa: E402
+
+SECRET = "bench-webhook-secret"
+NEW_USER_OFFSET = 1_000_000  # новые пользователи из /start — после заранее созданных
+USER_SPAN = 100_000_000  # все telegram_id бенчмарка, удаляются после запуска
+DEFAULT_MIX = "start=40,pre_checkout=20,payment=20,claim_gift=20"
+
+
+class Tracker:
+    """Outer middleware диспетчера: время окончания обработки каждого update_id"""
+
+    def __init__(self):
+        self.done = {}
+        self.errors = Counter()
+
+    async def __call__(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            self.errors[type(e).__name__] += 1
+            raise
+        finally:
+            self.done[event.update_id] = time.perf_counter()
+
+
+class UpdateFactory:
+    """Апдейты в формате Bot API: /start с реферальным кодом, pre_checkout_query, оплата, claim_gift"""
+
+    def __init__(self, users: list[int], snapshot, mix: dict, seed: int):
+        self.rnd = random.Random(seed)
+        self.users = users
+        self.snapshot = snapshot
+        self.kinds = list(mix)
+        self.weights = list(mix.values())
+        self.run = int(time.time())
+        self._update_ids = count(1)
+        self._new_users = count(BENCH_USER_BASE + NEW_USER_OFFSET)
+
+    def next(self) -> tuple[str, dict]:
+        kind = self.rnd.choices(self.kinds, self.weights)[0]
+        update_id = next(self._update_ids)
+        return kind, {"update_id": update_id, **getattr(self, f"_{kind}")(update_id)}
+
+    @staticmethod
+    def _message(n: int, telegram_id: int, **fields) -> dict:
+        return {
+            "message_id": n,
+            "date": int(time.time()),
+            "chat": {"id": telegram_id, "type": "private"},
+            "from": {"id": telegram_id, "is_bot": False, "first_name": "Bench"},
+            **fields,
+        }
+
+    def _item(self) -> dict:
+        return self.snapshot.item(self.rnd.randrange(len(self.snapshot)))
+
+    def _payload(self, telegram_id: int, item: dict) -> str:
+        return json.dumps({"item_id": item["id"], "product_id": item["product_id"], "user_id": telegram_id})
+
+    def _start(self, n: int) -> dict:
+        telegram_id = next(self._new_users)
+        text = f"/start {self.rnd.choice(self.users)}" if self.rnd.random() < 0.8 else "/start"
+        return {"message": self._message(n, telegram_id, text=text)}
+
+    def _pre_checkout(self, n: int) -> dict:
+        telegram_id, item = self.rnd.choice(self.users), self._item()
+        return {"pre_checkout_query": {
+            "id": f"pcq{n}",
+            "from": {"id": telegram_id, "is_bot": False, "first_name": "Bench"},
+            "currency": "XTR",
+            "total_amount": item["price_stars"],
+            "invoice_payload": self._payload(telegram_id, item),
+        }}
+
+    def _payment(self, n: int) -> dict:
+        telegram_id, item = self.rnd.choice(self.users), self._item()
+        return {"message": self._message(n, telegram_id, successful_payment={
+            "currency": "XTR",
+            "total_amount": item["price_stars"],
+            "invoice_payload": self._payload(telegram_id, item),
+            "telegram_payment_charge_id": f"bench-{self.run}-{n}",
+            "provider_payment_charge_id": f"bench-{self.run}-{n}",
+        })}
+
+    def _claim_gift(self, n: int) -> dict:
+        telegram_id = self.rnd.choice(self.users)
+        return {"callback_query": {
+            "id": f"cb{n}",
+            "from": {"id": telegram_id, "is_bot": False, "first_name": "Bench"},
+            "chat_instance": "bench",
+            "data": "claim_gift",
+            "message": self._message(n, telegram_id, text="🎁"),
+        }}
+
+
+async def run_step(app, factory: UpdateFactory, tracker: Tracker, rate: float, seconds: float,
+                   drain_timeout: float, update_queue) -> dict:
+    """rate апдейтов в секунду в течение seconds, затем ожидание обработки принятых"""
+    total = max(1, int(rate * seconds))
+    sent, kinds, accepted = {}, {}, []
+    statuses = Counter()
+    responses, lags = [], []
+    errors_before = sum(tracker.errors.values())
+
+    async def post(update_id: int, body: dict):
+        started = time.perf_counter()
+        try:
+            status, _ = await asgi_request(app, "POST", "/webhook", body=body,
+                                           headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+        except Exception as e:
+            status = type(e).__name__  # в синхронном режиме ошибка обработчика доходит до webhook
+        responses.append(time.perf_counter() - started)
+        statuses[status] += 1
+        if status == 200:
+            accepted.append(update_id)
+
+    tasks = []
+    started = time.perf_counter()
+    for i in range(total):
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            lags.append(-delay)  # event loop не успевает за расписанием
+        kind, body = factory.next()
+        sent[body["update_id"]] = time.perf_counter()
+        kinds[body["update_id"]] = kind
+        tasks.append(asyncio.create_task(post(body["update_id"], body)))
+    await asyncio.gather(*tasks)
+
+    # с WEBHOOK_QUEUE=1 ответ приходит раньше обработки — ждём воркеры
+    deadline = time.perf_counter() + drain_timeout
+    while any(update_id not in tracker.done for update_id in accepted) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.02)
+
+    finished = [update_id for update_id in accepted if update_id in tracker.done]
+    latencies = {update_id: tracker.done[update_id] - sent[update_id] for update_id in finished}
+    wall = max(tracker.done[update_id] for update_id in finished) - started if finished else seconds
+    handler_errors = sum(tracker.errors.values()) - errors_before
+    errors = total - len(accepted) + (len(accepted) - len(finished)) + handler_errors
+
+    by_kind = {}
+    for kind in factory.kinds:
+        values = [latency for update_id, latency in latencies.items() if kinds[update_id] == kind]
+        if values:
+            summary = summarize(values, wall)
+            by_kind[kind] = {key: summary[key] for key in ("count", "p50_ms", "p99_ms", "max_ms")}
+
+    response = summarize(responses, wall)
+    result = {
+        "rate": round(rate, 1),
+        "sent": total,
+        "finished": len(finished),
+        "throughput_ups": round(len(finished) / wall, 1) if wall else None,
+        "latency": summarize(list(latencies.values()), wall),
+        "response": {key: response[key] for key in ("p50_ms", "p99_ms", "max_ms")},
+        "by_kind": by_kind,
+        "statuses": {str(k): v for k, v in statuses.items()},
+        "handler_errors": handler_errors,
+        "error_rate": round(errors / total, 4),
+        "send_lag_max_ms": round(max(lags) * 1000, 1) if lags else 0,
+    }
+    if update_queue.enabled:
+        result["queue"] = update_queue.stats()
+    return result
+
+
+def breach(step: dict, args) -> str | None:
+    p99 = step["latency"]["p99_ms"]
+    if p99 is None or p99 > args.max_p99:
+        return f"p99 {p99} мс > {args.max_p99} мс"
+    if step["error_rate"] > args.max_error_rate:
+        return f"ошибок {step['error_rate']:.2%} > {args.max_error_rate:.2%}"
+    return None
+
+
+async def prepare_users(count: int, gift_ready: int) -> list[int]:
+    """Пользователи с trade link; первые gift_ready уже набрали трёх рефералов"""
+    from sqlalchemy import update
+    from database import async_session, user_cache, User
+
+    users = await create_bench_users(count)
+    ready = users[:gift_ready]
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(update(User).where(User.telegram_id.in_(ready)).values(referrals=3))
+    user_cache.invalidate(*ready)
+    return users
+
+
+async def run(args) -> dict:
+    standin = Standin(args.items, args.latency / 1000, args.bot_latency / 1000, seed=args.seed)
+    runner, base_url = await standin.start()
+    workdir = tempfile.mkdtemp(prefix="bench_webhook_")
+    configure_service(base_url, workdir,
+                      args.database_url or f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ["WEBHOOK_SECRET"] = SECRET
+    os.environ["WEBHOOK_QUEUE"] = "1" if args.queue else "0"
+
+    from cache import cache
+    from xpanda import xpanda
+    from database import engine, init_db
+    from bot import dp
+    import app as service
+
+    cache._ip_logged = True  # без запроса к api.ipify.org
+    await asyncio.gather(*(job.run_once() for job in cache.scheduler.jobs.values()))
+    await init_db()
+    await reset_bench_users(USER_SPAN)
+
+    tracker = Tracker()
+    dp.update.outer_middleware(tracker)
+    service.update_queue.start()
+    steps = []
+    stopped_by = None
+    try:
+        users = await prepare_users(args.users, args.gift_ready)
+        mix = {kind: float(weight) for kind, weight in (part.split("=") for part in args.mix.split(","))}
+        factory = UpdateFactory(users, cache.snapshot, mix, args.seed)
+
+        rate = args.rate
+        while True:
+            step = await run_step(service.app, factory, tracker, rate, args.step_seconds,
+                                  args.drain_timeout, service.update_queue)
+            steps.append(step)
+            print(f"[BENCH] {step['rate']:>7} ups: обработано {step['finished']}/{step['sent']}, "
+                  f"{step['throughput_ups']} ups, p50 {step['latency']['p50_ms']} мс, "
+                  f"p99 {step['latency']['p99_ms']} мс, ошибок {step['error_rate']:.2%}")
+            stopped_by = breach(step, args)
+            if stopped_by or rate >= args.max_rate:
+                break
+            rate = min(args.max_rate, rate * args.rate_factor)
+    finally:
+        await service.update_queue.stop()
+        await reset_bench_users(USER_SPAN)
+        await engine.dispose()
+        await xpanda.close()
+        for module in ("app", "bot", "purchases", "notifier"):
+            if module in sys.modules:
+                await sys.modules[module].bot.session.close()
+        await runner.cleanup()
+
+    sustained = [step for step in steps if breach(step, args) is None]
+    return {
+        "database": engine.dialect.name,
+        "queue": args.queue,
+        "stopped_by": stopped_by,
+        "max_sustained_rate": sustained[-1]["rate"] if sustained else None,
+        "max_throughput_ups": max((step["throughput_ups"] or 0 for step in steps), default=None),
+        "steps": steps,
+        "standin_requests": dict(standin.requests),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=20_000, help="предметов в прайсе заглушки")
+    parser.add_argument("--latency", type=float, default=20, help="задержка ответов Xpanda, мс")
+    parser.add_argument("--bot-latency", type=float, default=20, help="задержка ответов Bot API, мс")
+    parser.add_argument("--database-url", help="отдельная база PostgreSQL (по умолчанию — временный SQLite)")
+    parser.add_argument("--users", type=int, default=200, help="заранее созданных пользователей с trade link")
+    parser.add_argument("--gift-ready", type=int, default=50, help="из них с тремя рефералами")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="доли типов апдейтов")
+    parser.add_argument("--queue", action="store_true", help="WEBHOOK_QUEUE=1: ответ до обработки")
+    parser.add_argument("--rate", type=float, default=20, help="начальная частота, апдейтов/с")
+    parser.add_argument("--rate-factor", type=float, default=1.5, help="рост частоты между ступенями")
+    parser.add_argument("--max-rate", type=float, default=5000)
+    parser.add_argument("--step-seconds", type=float, default=10)
+    parser.add_argument("--drain-timeout", type=float, default=30, help="ожидание обработки после ступени, с")
+    parser.add_argument("--max-p99", type=float, default=500, help="порог p99 обработки, мс")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    report = {
+        "benchmark": "webhook",
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "database_url")},
+    }
+    with redirect_stdout(sys.stderr):
+        report["results"] = asyncio.run(run(args))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# standin.py — локальная заглушка Xpanda и Telegram Bot API для офлайн-бенчмарков
+#
+# Отдельно: python benchmarks/standin.py [--items 50000] [--latency 20] [--port 8081]
+# и запустить сервис с XPANDA_BASE_URL=http://127.0.0.1:8081 TELEGRAM_API_URL=http://127.0.0.1:8081
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import make_raw_prices  # noqa: E402
+
+
+class Standin:
+    """
+    Эндпоинты Xpanda (/items/prices/, /balance/, /purchases/, /deals) и
+    методы Bot API (/bot<token>/<method>), которые вызывает сервис.
+
+    Прайс строится один раз из synthetic.make_raw_prices и отдаётся готовыми
+    байтами. Каждый ответ задерживается на latency (± jitter) секунд — так
+    имитируется сеть до маркета и до Telegram.
+    """
+
+    def __init__(self, items: int, latency: float = 0.02, bot_latency: float = 0.02,
+                 jitter: float = 0.2, balance: int = 10_000_000, seed: int = 1):
+        self.records = make_raw_prices(items, seed)
+        self.by_name = {record["n"]: record for record in self.records}
+        self.prices_body = json.dumps({"items": self.records, "count": len(self.records)},
+                                      ensure_ascii=False).encode()
+        self.latency = latency
+        self.bot_latency = bot_latency
+        self.jitter = jitter
+        self.balance = balance
+        self.purchases = {}  # custom_id -> ответ, как идемпотентность у Xpanda
+        self.requests = Counter()
+        self._ids = iter(range(1, 1 << 62))
+
+    async def _delay(self, latency: float):
+        if latency > 0:
+            await asyncio.sleep(latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    async def prices(self, request: web.Request) -> web.Response:
+        await self._delay(self.latency)
+        names = request.query.getall("names[]", [])
+        if names:
+            self.requests["item_price"] += 1
+            items = [self.by_name[name] for name in names if name in self.by_name]
+            return web.json_response({"items": items, "count": len(items)})
+        self.requests["prices"] += 1
+        return web.Response(body=self.prices_body, content_type="application/json")
+
+    async def balance_handler(self, request: web.Request) -> web.Response:
+        self.requests["balance"] += 1
+        await self._delay(self.latency)
+        return web.json_response({"total": self.balance, "locked": 0, "available": self.balance})
+
+    async def purchase(self, request: web.Request) -> web.Response:
+        self.requests["purchases"] += 1
+        params = await request.json()
+        await self._delay(self.latency)
+        result = self.purchases.get(params.get("custom_id"))
+        if result is None:
+            result = self.purchases[params.get("custom_id")] = {
+                "id": next(self._ids),
+                "custom_id": params.get("custom_id"),
+                "product": params.get("product"),
+                "status": "created",
+            }
+        return web.json_response(result, status=201)
+
+    async def deal(self, request: web.Request) -> web.Response:
+        self.requests["deals"] += 1
+        await request.read()
+        await self._delay(self.latency)
+        return web.json_response({"id": next(self._ids), "status": "created"}, status=201)
+
+    async def bot_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.requests[f"bot.{method}"] += 1
+        form = await request.post()
+        await self._delay(self.bot_latency)
+        if method == "sendMessage":
+            chat_id = int(form.get("chat_id", 0))
+            result = {
+                "message_id": next(self._ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": form.get("text", ""),
+            }
+        elif method == "createInvoiceLink":
+            result = f"https://t.me/$bench{next(self._ids)}"
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_get("/items/prices/", self.prices)
+        app.router.add_get("/balance/", self.balance_handler)
+        app.router.add_post("/purchases/", self.purchase)
+        app.router.add_post("/deals", self.deal)
+        app.router.add_post("/bot{token}/{method}", self.bot_method)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, str]:
+        """Запускает сервер в текущем event loop; port=0 — свободный порт"""
+        runner = web.AppRunner(self.app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return runner, f"http://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=50_000)
+    parser.add_argument("--latency", type=float, default=20, help="задержка Xpanda, мс")
+    parser.add_argument("--bot-latency", type=float, default=20, help="задержка Bot API, мс")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    standin = Standin(args.items, args.latency / 1000, args.bot_latency / 1000)
+    print(f"Заглушка: {args.items} предметов, прайс {len(standin.prices_body) / 1024 / 1024:.1f} MB, "
+          f"http://{args.host}:{args.port}")
+    web.run_app(standin.app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
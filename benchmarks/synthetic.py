@@ -0,0 +1,57 @@
+# synthetic.py — генерация синтетического прайса Xpanda и записей кэша для бенчмарков
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WEAPONS = ["AK-47", "M4A4", "M4A1-S", "AWP", "Desert Eagle", "Glock-18", "USP-S", "P250",
+           "FAMAS", "Galil AR", "MP9", "MAC-10", "UMP-45", "P90", "Nova", "XM1014",
+           "★ Karambit", "★ Butterfly Knife", "★ Sport Gloves", "Sticker"]
+WEARS = ["Factory New", "Minimal Wear", "Field-Tested", "Well-Worn", "Battle-Scarred"]
+SYLLABLES = ["red", "line", "hyper", "beast", "dragon", "lore", "fade", "asiimov", "neo",
+             "noir", "vulcan", "fire", "serpent", "case", "hardened", "tiger", "tooth", "ice"]
+
+
+def make_raw_prices(count: int, seed: int = 1) -> list[dict]:
+    """Записи в формате /items/prices/: {"n": имя, "p": цена, "q": количество}"""
+    rnd = random.Random(seed)
+    records = []
+    for i in range(count):
+        skin = "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(1, 3))).title()
+        prefix = rnd.choice(["", "", "", "StatTrak™ ", "Souvenir "])
+        name = f"{prefix}{rnd.choice(WEAPONS)} | {skin} #{i} ({rnd.choice(WEARS)})"
+        records.append({"n": name, "p": rnd.randint(1, 500_000), "q": rnd.randint(0, 40)})
+    return records
+
+
+def make_items(count: int, seed: int = 1, stars_rate: int = 45) -> list[dict]:
+    """Готовые записи кэша — такие же, как строит ItemsCache.update()"""
+    from catalog import item_id_for
+
+    items = []
+    for record in make_raw_prices(count, seed):
+        name, price_rub = record["n"], record["p"]
+        items.append({
+            "id": item_id_for(name),
+            "product_id": name,
+            "name": name,
+            "price_stars": max(1, int(price_rub / 1000 * stars_rate)),
+            "price_usd": round(price_rub / 1000, 2),
+            "price_rub": price_rub,
+            "image": f"https://via.placeholder.com/80x60?text={name[:20].replace(' ', '+')}",
+            "quantity": record["q"],
+        })
+    return items
+
+
+def make_snapshot(count: int, seed: int = 1):
+    """Снимок каталога из синтетического прайса — через тот же SnapshotBuilder, что и кэш"""
+    from catalog import CatalogSnapshot, SnapshotBuilder
+    from image_index import placeholder_image
+
+    builder = SnapshotBuilder(CatalogSnapshot.empty(), placeholder_image)
+    for record in make_raw_prices(count, seed):
+        builder.feed(record)
+    return builder.finish()
@@ -3,6 +3,7 @@ from aiogram import Bot, Dispatcher
 from dotenv import load_dotenv
 import os
 from handlers import register_handlers
+from config import bot_session
 
 load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
@@ -12,7 +13,7 @@ if not BOT_TOKEN:
 
 logging.basicConfig(level=logging.INFO)
 
-bot = Bot(token=BOT_TOKEN)
+bot = Bot(token=BOT_TOKEN, session=bot_session())
 dp = Dispatcher()
 
 register_handlers(dp)
\ No newline at end of file
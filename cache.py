@@ -3,198 +3,255 @@
 from datetime import datetime
 import asyncio
 import aiohttp
+import time
 import os
-import json
 from dotenv import load_dotenv
-from config import OWNER_ID
-from aiogram import Bot
+from catalog import CatalogSnapshot, ChangeSet, SnapshotBuilder
+from image_index import ImageIndex, load_image_index
+from metrics import cache_age_seconds, cache_items, cache_refresh_seconds
+from scheduler import PeriodicJob, Scheduler
+from snapshot_file import read_snapshot, write_snapshot
+from xpanda import xpanda, XpandaError
+from notifier import notifier
 
 load_dotenv()
 
-XPANDA_BASE_URL = "https://p2p.xpanda.pro/api/v1"
-XPANDA_API_KEY = os.getenv('XPANDA_API_KEY')
-BOT_TOKEN = os.getenv('BOT_TOKEN')
-bot = Bot(token=BOT_TOKEN)
-xpanda_headers = {
-    "Authorization": XPANDA_API_KEY,
-    "Content-Type": "application/json"
-}
-
 class ItemsCache:
     _instance = None
     _ip_logged = False  # флаг, чтобы логировать IP только один раз
     _cache_not_getted = True
+    _initialized = False
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(ItemsCache, cls).__new__(cls)
-            cls._instance.all_items = []
-            cls._instance.cache_timestamp = None
+            cls._instance.snapshot = CatalogSnapshot.empty()
             cls._instance.CACHE_UPDATE_INTERVAL = int(os.getenv("CACHE_UPDATE_INTERVAL", 300))
+            cls._instance.STREAM_PRICES = os.getenv("XPANDA_STREAM_PRICES", "0") == "1"
+            # Каждый успешный снимок сохраняется сюда для тёплого старта и shared-режима;
+            # пустая строка — не сохранять
+            cls._instance.snapshot_path = os.getenv("CATALOG_SNAPSHOT_PATH", "data/catalog.snapshot")
+            cls._instance.WARM_START_MAX_AGE = int(os.getenv("CACHE_WARM_START_MAX_AGE", 86400))
         return cls._instance
 
     def __init__(self):
-        # Загрузка изображений (только один раз)
-        self.skins_data = []
-        self.crates_data = []
-        self.stickers_data = []
+        # ItemsCache() возвращает тот же объект — инициализируем его один раз
+        if self._initialized:
+            return
+        self._initialized = True
+
         self.balance = {
             "total": 0,
             "locked": 0,
             "available": 0
         }
         self.balance_last_updated = None
+        self._image_index = None
 
-        try:
-            with open('data/skins.json', 'r', encoding='utf-8') as f:
-                self.skins_data = json.load(f)
-        except FileNotFoundError:
-            print("skins.json не найден")
-
-        try:
-            with open('data/crates.json', 'r', encoding='utf-8') as f:
-                self.crates_data = json.load(f)
-        except FileNotFoundError:
-            print("crates.json не найден")
+        # Прайс — раз в CACHE_UPDATE_INTERVAL, баланс — раз в BALANCE_UPDATE_INTERVAL
+        # (по умолчанию так же, как прайс — как было до раздельного расписания);
+        # после ошибок — экспоненциальная задержка до CACHE_BACKOFF_CAP
+        jitter = float(os.getenv("CACHE_JITTER", 0.1))
+        backoff_cap = float(os.getenv("CACHE_BACKOFF_CAP", 600))
+        self.scheduler = Scheduler(
+            PeriodicJob("prices", self.refresh_prices, self.CACHE_UPDATE_INTERVAL,
+                        jitter=jitter, backoff_cap=backoff_cap),
+            PeriodicJob("balance", self.update_balance,
+                        int(os.getenv("BALANCE_UPDATE_INTERVAL", self.CACHE_UPDATE_INTERVAL)),
+                        jitter=jitter, backoff_cap=backoff_cap),
+        )
 
-        try:
-            with open('data/stickers.json', 'r', encoding='utf-8') as f:
-                self.stickers_data = json.load(f)
-        except FileNotFoundError:
-            print("stickers.json не найден")
+    @property
+    def image_index(self) -> ImageIndex:
+        """Индекс картинок skins/crates/stickers — загружается при первом обращении"""
+        if self._image_index is None:
+            started = time.perf_counter()
+            self._image_index = load_image_index()
+            print(f"[IMAGES] Индекс картинок загружен за {time.perf_counter() - started:.2f} с")
+        return self._image_index
 
     async def update_balance(self):
         """Обновляет только баланс"""
-        url = XPANDA_BASE_URL + "/balance/"
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    url,
-                    headers=xpanda_headers,
-                    timeout=15
-                ) as resp:
-                    if resp.status != 200:
-                        print(f"[BALANCE] Ошибка статуса: {resp.status}")
-                        return False
-                    
-                    data = await resp.json()
-                    self.balance = {
-                        "total": data.get("total", 0),
-                        "locked": data.get("locked", 0),
-                        "available": data.get("available", 0)
-                    }
-                    self.balance_last_updated = datetime.now()
-                    print(f"[BALANCE] Обновлён: available = {self.balance['available']}")
-                    return True
+            self.balance = await xpanda.get_balance()
+            self.balance_last_updated = datetime.now()
+            print(f"[BALANCE] Обновлён: available = {self.balance['available']}")
+            return True
+        except XpandaError as e:
+            print(f"[BALANCE] Ошибка статуса: {e.status}")
+            return False
         except Exception as e:
             print(f"[BALANCE ERROR] {type(e).__name__}: {str(e)}")
-            await bot.send_message(OWNER_ID,f"❌ Ошибка обновления баланса XPANDA:\n{type(e).__name__}: {str(e)}")
+            notifier.notify(f"❌ Ошибка обновления баланса XPANDA:\n{type(e).__name__}: {str(e)}", "balance")
             return False
     
+    @property
+    def cache_timestamp(self) -> datetime | None:
+        return self.snapshot.timestamp
+
+    @property
+    def last_changes(self) -> ChangeSet | None:
+        """Что изменилось при последнем обновлении (None — снимок построен с нуля)"""
+        return self.snapshot.changes
+
+    @property
+    def stale(self) -> bool:
+        """Снимок загружен с диска и ещё не обновлён живым опросом"""
+        return self.snapshot.stale
+
+    async def warm_start(self) -> bool:
+        """Загружает сохранённый снимок до первого опроса Xpanda"""
+        path = self.snapshot_path
+        if not path or not os.path.exists(path):
+            return False
+        started = time.perf_counter()
+        try:
+            snapshot, balance = await asyncio.to_thread(read_snapshot, path, self.snapshot, True)
+        except Exception as e:
+            print(f"[WARM START] Не удалось прочитать {path}: {type(e).__name__}: {str(e)}")
+            return False
+
+        if snapshot.timestamp and (datetime.now() - snapshot.timestamp).total_seconds() > self.WARM_START_MAX_AGE:
+            print(f"[WARM START] Снимок от {snapshot.timestamp} слишком старый — ждём живой опрос")
+            return False
+
+        self.snapshot = snapshot
+        if balance is not None:
+            self.balance = balance
+        print(f"[WARM START] Загружено {len(snapshot)} предметов (снимок от {snapshot.timestamp}) "
+              f"за {time.perf_counter() - started:.2f} с")
+        return True
+
+    async def _persist(self):
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            await asyncio.to_thread(write_snapshot, self.snapshot_path, self.snapshot, self.balance)
+        except Exception as e:
+            print(f"[CACHE] Ошибка сохранения снимка: {type(e).__name__}: {str(e)}")
+
+    def get_item(self, item_id: int) -> dict | None:
+        """Предмет текущего снимка по id — за O(1)"""
+        return self.snapshot.by_item_id(item_id)
+
+    def get_item_by_product_id(self, product_id: str) -> dict | None:
+        """Предмет текущего снимка по product_id — за O(1)"""
+        return self.snapshot.by_product_id(product_id)
+
     def get_skin_image(self, name: str) -> str:
-        name_lower = name.lower().strip()
-        cleaned_name = name_lower.replace('stattrak™ ', '').split('(')[0].strip()
-        cleaned_name = cleaned_name.replace('souvenir ', '').split('(')[0].strip()
+        return self.image_index.lookup(name)
 
-        for skin in self.skins_data:
-            if cleaned_name in skin.get('name', '').lower() or cleaned_name in skin.get('market_hash_name', '').lower():
-                if img := skin.get('image'):
-                    return img
+    def _build_snapshot(self, items_list: list) -> tuple[CatalogSnapshot, int]:
+        """Новый снимок относительно текущего и число пропущенных записей"""
+        builder = SnapshotBuilder(self.snapshot, self.get_skin_image)
+        for item in items_list:
+            builder.feed(item)
+        return builder.finish(datetime.now()), builder.skipped
 
-        for crate in self.crates_data:
-            if name_lower == crate.get('name', '').lower() or cleaned_name in crate.get('name', '').lower():
-                if img := crate.get('image'):
-                    return img
+    async def _fetch_snapshot_streaming(self) -> tuple[CatalogSnapshot, int]:
+        """
+        Записи прайса идут в SnapshotBuilder прямо из потока ответа: тело
+        целиком и промежуточный список записей в памяти не собираются.
+        Пачки разбираются в потоке, event loop только читает ответ
+        """
+        # индекс картинок грузится заранее и тоже в потоке, а не при первой новой записи
+        await asyncio.to_thread(lambda: self.image_index)
+        builder = SnapshotBuilder(self.snapshot, self.get_skin_image)
 
-        for sticker in self.stickers_data:
-            if cleaned_name in sticker.get('name', '').lower() or name_lower in sticker.get('name', '').lower():
-                if img := sticker.get('image'):
-                    return img
+        def feed(records: list):
+            for record in records:
+                builder.feed(record)
 
-        return f"https://via.placeholder.com/80x60?text={name[:20].replace(' ', '+')}"
+        async for records in xpanda.iter_prices():
+            await asyncio.to_thread(feed, records)
+        return await asyncio.to_thread(builder.finish, datetime.now()), builder.skipped
 
-    async def update(self):
-        while True:
-            if self._cache_not_getted:
-                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] → Обновление кэша предметов...")
-                
-
-            # Получаем IP сервера один раз (4-й способ)
-            if not self._ip_logged:
-                try:
-                    async with aiohttp.ClientSession() as temp_session:
-                        async with temp_session.get("https://api.ipify.org") as resp:
-                            server_ip = await resp.text()
-                            print(f"[DEBUG IP] Исходящий IP сервера: {server_ip}")
-                            await bot.send_message(OWNER_ID,f"[DEBUG IP] Исходящий IP сервера: {server_ip}")
-                            self._ip_logged = True  # больше не логируем
-                except Exception as e:
-                    print(f"[DEBUG IP] Ошибка получения IP: {str(e)}")
+    async def _log_server_ip(self):
+        # Получаем IP сервера один раз (4-й способ)
+        try:
+            # отдельная сессия без заголовков Xpanda: ключ API не должен уйти на ipify
+            async with aiohttp.ClientSession() as temp_session:
+                async with temp_session.get("https://api.ipify.org") as resp:
+                    server_ip = await resp.text()
+                    print(f"[DEBUG IP] Исходящий IP сервера: {server_ip}")
+                    notifier.notify(f"[DEBUG IP] Исходящий IP сервера: {server_ip}")
+                    self._ip_logged = True  # больше не логируем
+        except Exception as e:
+            print(f"[DEBUG IP] Ошибка получения IP: {str(e)}")
 
+    async def refresh_prices(self) -> bool:
+        """Один опрос прайса; False — ошибка (планировщик повторит с задержкой)"""
+        started = time.perf_counter()
+        ok = await self._refresh_prices()
+        cache_refresh_seconds.observe(time.perf_counter() - started, result="ok" if ok else "error")
+        return ok
+
+    async def _refresh_prices(self) -> bool:
+        if self._cache_not_getted:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] → Обновление кэша предметов...")
+
+        if not self._ip_logged:
+            await self._log_server_ip()
+
+        try:
+            started = time.perf_counter()
             try:
-                url = XPANDA_BASE_URL + "/items/prices/"
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url, headers=xpanda_headers, timeout=45) as resp:
-                        if resp.status != 200:
-                            if self._cache_not_getted:
-                                print(f"   Ошибка: статус {resp.status}")
-                                await bot.send_message(OWNER_ID,f"   Ошибка: статус {resp.status}")
-                                self._cache_not_getted = False
-                            continue
-                        self._cache_not_getted = True
-                        data = await resp.json()
-                        items_list = data.get("items", [])
-
-                        if not isinstance(items_list, list):
-                            print("   'items' не список")
-                            continue
-
-                        result = []
-                        skipped = 0
-
-                        for item in items_list:
-                            name = item.get("n")
-                            price_rub = item.get("p", 0)
-                            quantity = item.get("q", 0)
-
-                            if not name or price_rub <= 0:
-                                skipped += 1
-                                continue
-
-                            price_stars = max(1, int(price_rub / 1000 * int(os.getenv("DOLAR_TO_STARS", 45))))
-                            price_usd = round(price_rub / 1000, 2)
-
-                            item_id = abs(hash(name)) % 1000000000
-                            product_id = name
-
-                            image = self.get_skin_image(name)
-
-                            result.append({
-                                "id": item_id,
-                                "product_id": product_id,
-                                "name": name,
-                                "price_stars": price_stars,
-                                "price_usd": price_usd,
-                                "price_rub": price_rub,
-                                "image": image,
-                                "quantity": quantity
-                            })
-
-                        self.all_items = result
-                        self.cache_timestamp = datetime.now()
-                        print(f"   Кэш обновлён! {len(result)} предметов (пропущено: {skipped})")
-                        self._cache_not_getted = True
-                        print(f"   Пример первого предмета: {result[0] if result else 'пусто'}")
-
-            except Exception as e:
+                if self.STREAM_PRICES:
+                    snapshot, skipped = await self._fetch_snapshot_streaming()
+                else:
+                    items_list = await xpanda.get_prices()
+                    if not isinstance(items_list, list):
+                        print("   'items' не список")
+                        return False
+                    # Разбор прайса и построение индексов идут в потоке, чтобы не
+                    # блокировать event loop
+                    snapshot, skipped = await asyncio.to_thread(self._build_snapshot, items_list)
+            except XpandaError as e:
                 if self._cache_not_getted:
-                    print(f"   Ошибка обновления кэша: {type(e).__name__}: {str(e)}")
+                    print(f"   Ошибка: статус {e.status}")
+                    notifier.notify(f"   Ошибка: статус {e.status}", "prices")
                     self._cache_not_getted = False
-                await bot.send_message(OWNER_ID,f"❌ Ошибка обновления кэша предметов:\n{type(e).__name__}: {str(e)}")
+                return False
 
-            await self.update_balance()
-            await asyncio.sleep(self.CACHE_UPDATE_INTERVAL)
+            # новый снимок подменяет старый одним присваиванием
+            self.snapshot = snapshot
+            print(f"   Прайс получен и разобран за {time.perf_counter() - started:.2f} с "
+                  f"({'поток' if self.STREAM_PRICES else 'целиком'})")
+            print(f"   Кэш обновлён! {len(snapshot)} предметов (пропущено: {skipped}), "
+                  f"изменения: {self.snapshot.changes}")
+            self._cache_not_getted = True
+            print(f"   Пример первого предмета: {snapshot.item(0) if len(snapshot) else 'пусто'}")
+
+        except Exception as e:
+            if self._cache_not_getted:
+                print(f"   Ошибка обновления кэша: {type(e).__name__}: {str(e)}")
+                self._cache_not_getted = False
+            notifier.notify(f"❌ Ошибка обновления кэша предметов:\n{type(e).__name__}: {str(e)}", "prices")
+            return False
+
+        if self.snapshot_path:
+            await self._persist()
+        return True
+
+    async def update(self):
+        """Фоновое обновление: прайс и баланс — каждый по своему расписанию"""
+        await self.scheduler.run()
+
+    def status(self) -> dict:
+        snapshot = self.snapshot
+        age = (datetime.now() - snapshot.timestamp).total_seconds() if snapshot.timestamp else None
+        return {
+            "items": len(snapshot),
+            "version": snapshot.version,
+            "cache_timestamp": snapshot.timestamp.isoformat() if snapshot.timestamp else None,
+            "age_seconds": round(age, 1) if age is not None else None,
+            "stale": snapshot.stale,
+            "balance_updated": self.balance_last_updated.isoformat() if self.balance_last_updated else None,
+            "jobs": self.scheduler.stats(),
+        }
 
 
 # Глобальный экземпляр кэша (синглтон)
-cache = ItemsCache()
\ No newline at end of file
+cache = ItemsCache()
+
+cache_items.func = lambda: len(cache.snapshot)
+cache_age_seconds.func = lambda: (datetime.now() - cache.snapshot.timestamp).total_seconds()
\ No newline at end of file
@@ -0,0 +1,525 @@
+# catalog.py — неизменяемый снимок каталога предметов вместе с индексами
+
+import hashlib
+import heapq
+import os
+import sys
+import time
+import orjson
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from datetime import datetime
+from itertools import compress, count
+from search_index import NgramIndex
+
+# Версии снимков начинаются с текущего времени в мс: после рестарта или в
+# другом процессе номер не совпадёт со старым, и ETag не спутается
+_versions = count(time.time_ns() // 1_000_000)
+
+# Сколько самых дешёвых предметов держать готовыми для выдачи подарков
+GIFT_POOL_SIZE = int(os.getenv("CHEAP_ITEMS_COUNT", 5))
+
+# Сколько готовых тел ответов /api/items держать на один снимок
+PAGE_CACHE_SIZE = 512
+
+
+def item_id_for(name: str, occurrence: int = 0) -> int:
+    """
+    id предмета по названию — одинаковый во всех процессах и после рестарта.
+    Повторы названия в одном прайсе (occurrence > 0) получают свои id
+    """
+    key = name if occurrence == 0 else f"{name}\0{occurrence}"
+    # 10**15 < 2**53: id без потерь помещается в число JavaScript
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big") % 10**15
+
+
+def _number_array(values: list) -> array:
+    """Целые цены — в int64, если среди них есть дробные — в double"""
+    try:
+        return array('q', values)
+    except TypeError:
+        return array('d', values)
+
+
+def _price_stars(price_rub, stars_rate: int) -> int:
+    return max(1, int(price_rub / 1000 * stars_rate))
+
+
+def _price_usd(price_rub) -> float:
+    return round(price_rub / 1000, 2)
+
+
+def _derive(ids: array, price_rub: array, stars_rate: int) -> tuple:
+    """
+    Производные колонки и индексы снимка с нуля:
+    (price_stars, price_usd, id -> позиция, порядок по цене, цены в этом порядке, позиции подарков)
+    """
+    # Конвертация цен — один проход по колонке с уже известным курсом
+    price_stars = array('q', [_price_stars(p, stars_rate) for p in price_rub])
+    price_usd = array('d', [_price_usd(p) for p in price_rub])
+    return (price_stars, price_usd) + _indexes(ids, price_rub, price_stars)
+
+
+def _indexes(ids: array, price_rub: array, price_stars: array) -> tuple:
+    """Индексы по готовым колонкам цен: (id -> позиция, порядок по цене, цены в этом порядке, позиции подарков)"""
+    # item_id -> позиция; product_id (название) ищется через name_docs индекса
+    positions_by_id = {}
+    for position, item_id in enumerate(ids):
+        positions_by_id.setdefault(item_id, position)
+
+    # Позиции предметов по возрастанию price_rub: порог доступности по балансу —
+    # это bisect по отсортированным ценам, а не проход по всему каталогу
+    price_order = array('i', sorted(range(len(price_rub)), key=price_rub.__getitem__))
+    sorted_prices = _number_array([price_rub[i] for i in price_order])
+
+    # heapq.nsmallest с key эквивалентен sorted(...)[:n], включая порядок равных цен
+    gift_positions = heapq.nsmallest(GIFT_POOL_SIZE, range(len(price_rub)), key=price_stars.__getitem__)
+    return positions_by_id, price_order, sorted_prices, gift_positions
+
+
+class CatalogSnapshot:
+    """
+    Каталог одного обновления кэша в колоночном виде и индексы по нему.
+
+    Вместо списка словарей хранятся параллельные массивы: названия
+    (интернированные, product_id — тот же объект), id, цены, количество и
+    картинки. Словарь предмета собирается только для отдаваемой страницы.
+
+    Снимок не меняется после создания: кэш подменяет его целиком одной
+    операцией присваивания, поэтому обработчик, взявший ссылку на снимок,
+    видит согласованные колонки и индексы до конца запроса.
+    """
+
+    def __init__(self, names: list[str], ids: array, price_rub: array, quantity: array,
+                 images: list[str], stars_rate: int, timestamp: datetime | None = None,
+                 search: tuple | None = None, changes: "ChangeSet | None" = None,
+                 version: int | None = None, stale: bool = False, derived: tuple | None = None):
+        self.names = names
+        self.ids = ids
+        self.price_rub = price_rub
+        self.quantity = quantity
+        self.images = images
+        self.stars_rate = stars_rate
+        self.timestamp = timestamp
+        self.version = version if version is not None else next(_versions)
+        self.changes = changes
+        self.stale = stale  # снимок с диска, ещё не подтверждённый живым опросом
+
+        # Цены в звёздах и долларах, id -> позиция, порядок по цене и подарки.
+        # SnapshotBuilder передаёт их готовыми (derived), перенося неизменённые
+        # строки из предыдущего снимка; иначе — считаются с нуля
+        if derived is None:
+            derived = _derive(ids, price_rub, stars_rate)
+        (self.price_stars, self.price_usd, self._positions_by_id,
+         self._price_order, self._sorted_prices, self._gift_positions) = derived
+
+        # Поисковый индекс общий для цепочки снимков и только дополняется:
+        # номер документа -> позиция в этом снимке (-1 — предмета уже нет)
+        if search is None:
+            search = _fresh_search(names)
+        self.search_index, self.name_docs, self._doc_positions = search
+
+        self._timestamp_iso = timestamp.isoformat() if timestamp else None
+        self._pages = {}
+        self._duplicates = None  # название -> позиции, только для повторяющихся
+        self._position_docs = None  # позиция -> документ индекса
+
+        self._affordable = (None, None)  # (cutoff, позиции в порядке каталога)
+        self.gift_pool = [self.item(i) for i in self._gift_positions]
+
+    @classmethod
+    def empty(cls) -> "CatalogSnapshot":
+        return cls([], array('q'), array('q'), array('q'), [], stars_rate=0)
+
+    def __len__(self):
+        return len(self.names)
+
+    def item(self, position: int) -> dict:
+        """Словарь предмета в том виде, в каком его отдаёт API"""
+        name = self.names[position]
+        return {
+            "id": self.ids[position],
+            "product_id": name,
+            "name": name,
+            "price_stars": self.price_stars[position],
+            "price_usd": self.price_usd[position],
+            "price_rub": self.price_rub[position],
+            "image": self.images[position],
+            "quantity": self.quantity[position]
+        }
+
+    @property
+    def items(self) -> list[dict]:
+        """Все предметы словарями — дорого, только для совместимости"""
+        return [self.item(i) for i in range(len(self.names))]
+
+    def occurrence(self, name: str, k: int) -> tuple[int | None, int | None]:
+        """
+        (позиция, документ индекса) k-го (с нуля) вхождения названия. Одно
+        название может встретиться в прайсе несколько раз — каждое вхождение
+        отдельный предмет со своим документом
+        """
+        if k == 0:
+            position = self.position_of(name)
+            return position, self.name_docs.get(name) if position is not None else None
+
+        if self._duplicates is None:
+            repeated = {name for name, n in Counter(self.names).items() if n > 1}
+            self._duplicates = {}
+            for position, value in enumerate(self.names):
+                if value in repeated:
+                    self._duplicates.setdefault(value, []).append(position)
+        positions = self._duplicates.get(name)
+        if positions is None or k >= len(positions):
+            return None, None
+
+        if self._position_docs is None:
+            self._position_docs = array('i', [-1]) * len(self.names)
+            for doc, position in enumerate(self._doc_positions):
+                if position >= 0:
+                    self._position_docs[position] = doc
+        position = positions[k]
+        doc = self._position_docs[position]
+        return position, doc if doc >= 0 else None
+
+    def position_of(self, name: str) -> int | None:
+        """Позиция первого предмета с таким названием"""
+        doc = self.name_docs.get(name)
+        doc_positions = self._doc_positions
+        if doc is None or doc >= len(doc_positions) or doc_positions[doc] < 0:
+            return None
+        return doc_positions[doc]
+
+    def by_product_id(self, product_id: str) -> dict | None:
+        """Предмет по product_id (названию) или None"""
+        position = self.position_of(product_id)
+        return None if position is None else self.item(position)
+
+    def by_item_id(self, item_id: int) -> dict | None:
+        """Предмет по id или None"""
+        position = self._positions_by_id.get(item_id)
+        return None if position is None else self.item(position)
+
+    def find(self, query: str) -> list[int]:
+        """Позиции предметов, в названии которых есть query (уже в нижнем регистре)"""
+        doc_positions = self._doc_positions
+        positions = [doc_positions[doc]
+                     for doc in self.search_index.search(query, stop=len(doc_positions))
+                     if doc_positions[doc] >= 0]
+        # обычно документы идут в порядке каталога, и сортировка — один проход
+        positions.sort()
+        return positions
+
+    def search(self, query: str) -> list[dict]:
+        """Предметы, в названии которых есть query, в порядке каталога"""
+        return [self.item(i) for i in self.find(query)]
+
+    def affordable_count(self, available) -> int:
+        return bisect_right(self._sorted_prices, available)
+
+    def affordable(self, available, positions=None):
+        """
+        Позиции предметов с price_rub <= available в порядке каталога.
+
+        Без positions результат кэшируется по порогу: пока баланс не
+        изменился настолько, чтобы сдвинуть порог, повторные запросы
+        отдают готовый массив.
+        """
+        if positions is not None:
+            price_rub = self.price_rub
+            return [i for i in positions if price_rub[i] <= available]
+
+        cutoff = self.affordable_count(available)
+        cached_cutoff, cached = self._affordable
+        if cached_cutoff != cutoff:
+            # отметить дешёвые позиции и выбрать их в порядке каталога — без сортировки
+            mask = bytearray(len(self.names))
+            for i in self._price_order[:cutoff]:
+                mask[i] = 1
+            cached = array('i', compress(range(len(mask)), mask))
+            self._affordable = (cutoff, cached)
+        return cached
+
+    def etag(self, available) -> str:
+        """
+        ETag ответа /api/items: тело зависит только от снимка, баланса и URL.
+        stale входит отдельно: ведомый процесс снимает его без смены версии
+        """
+        return f'"{self.version}-{available}{"-stale" if self.stale else ""}"'
+
+    def encode_page(self, positions, page: int, limit: int, available,
+                    cache_key: tuple | None = None) -> bytes:
+        """
+        Готовое JSON-тело ответа /api/items для страницы из positions
+        (None — весь каталог). Если передан cache_key, тело запоминается
+        до конца жизни снимка.
+        """
+        if cache_key is not None:
+            key = (cache_key, page, limit, available)
+            body = self._pages.get(key)
+            if body is not None:
+                return body
+
+        start = (page - 1) * limit
+        if positions is None:
+            page_positions = range(start, min(start + limit, len(self.names)))
+            total = len(self.names)
+        else:
+            page_positions = positions[start:start + limit]
+            total = len(positions)
+
+        body = orjson.dumps({
+            "items": [self.item(i) for i in page_positions],
+            "total": total,
+            "page": page,
+            "pages": (total + limit - 1) // limit if limit > 0 else 1,
+            "cache_timestamp": self._timestamp_iso,
+            "stale": self.stale,
+            "available_balance": available
+        })
+
+        if cache_key is not None:
+            if len(self._pages) >= PAGE_CACHE_SIZE:
+                self._pages.clear()
+            self._pages[key] = body
+        return body
+
+    def cheapest(self, n: int) -> list[dict]:
+        """n самых дешёвых по price_stars предметов (как sorted(...)[:n])"""
+        if n <= GIFT_POOL_SIZE:
+            return self.gift_pool[:n]
+        positions = heapq.nsmallest(n, range(len(self.names)), key=self.price_stars.__getitem__)
+        return [self.item(i) for i in positions]
+
+
+def reuse_search(names: list[str], previous: CatalogSnapshot) -> tuple:
+    """
+    Поиск для готовых колонок (снимок из файла): документы известных
+    названий берутся из индекса предыдущего снимка, дописываются только новые
+    """
+    index, name_docs = previous.search_index, previous.name_docs
+    if len(index) > 2 * len(previous) + 1000:
+        index, name_docs = NgramIndex(), {}
+    shared = index is previous.search_index
+
+    used_docs = set()
+    occurrences = {}
+    docs = []
+    for name in names:
+        k = occurrences.get(name, 0)
+        occurrences[name] = k + 1
+        if k == 0:
+            doc = name_docs.get(name)
+        else:
+            doc = previous.occurrence(name, k)[1] if shared else None
+        if doc is None or doc in used_docs:
+            doc = index.add(name.lower())
+            name_docs.setdefault(name, doc)
+        used_docs.add(doc)
+        docs.append(doc)
+
+    doc_positions = array('i', [-1]) * len(index)
+    for position, doc in enumerate(docs):
+        doc_positions[doc] = position
+    return index, name_docs, doc_positions
+
+
+def _fresh_search(names: list[str]) -> tuple:
+    """Новый поисковый индекс: по документу на предмет"""
+    index = NgramIndex(name.lower() for name in names)
+    name_docs = {}
+    for doc, name in enumerate(names):
+        name_docs.setdefault(name, doc)
+    return index, name_docs, array('i', range(len(names)))
+
+
+class ChangeSet:
+    """Отличия снимка от предыдущего: счётчики и id затронутых предметов"""
+
+    def __init__(self):
+        self.added = 0
+        self.removed = 0
+        self.repriced = 0
+        self.unchanged = 0
+        self.changed_ids = []  # id добавленных и переоценённых предметов
+        self.removed_ids = []
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.repriced)
+
+    def __str__(self):
+        return f"+{self.added} -{self.removed} ~{self.repriced} (без изменений: {self.unchanged})"
+
+
+class SnapshotBuilder:
+    """
+    Строит следующий снимок из записей /items/prices/ с учётом предыдущего.
+
+    Записи раскладываются по колонкам. Для известных названий id и картинка
+    берутся из предыдущего снимка; картинка и id ищутся лишь для новых
+    названий, и только они дописываются в поисковый индекс.
+
+    Цены в звёздах и долларах считаются только для добавленных и
+    переоценённых строк. Если позиции и id не сдвинулись (ничего не
+    добавлено и не удалено), индекс по id и подарки берутся из предыдущего
+    снимка, а порядок по цене лишь досортировывается для переоценённых.
+    """
+
+    def __init__(self, previous: CatalogSnapshot, image_lookup):
+        self.previous = previous
+        self.image_lookup = image_lookup
+        self.stars_rate = int(os.getenv("DOLAR_TO_STARS", 45))
+        self.skipped = 0
+        self.changes = ChangeSet()
+
+        self._names = []
+        self._ids = []
+        self._prices = []
+        self._quantities = []
+        self._images = []
+        self._docs = []
+        self._stars = []
+        self._usd = []
+        self._changed = []  # новые позиции добавленных и переоценённых строк
+        self._in_place = True  # каждая строка на своей прежней позиции с прежним id
+        self._used_docs = set()
+        self._occurrences = {}  # название -> сколько раз уже встретилось в этом прайсе
+        self._matched = set()  # позиции предыдущего снимка, нашедшиеся в новом
+
+        # Когда больше половины документов индекса — удалённые названия,
+        # индекс строится заново
+        index = previous.search_index
+        if len(index) > 2 * len(previous) + 1000:
+            self.index, self.name_docs = NgramIndex(), {}
+        else:
+            self.index, self.name_docs = index, previous.name_docs
+
+    def feed(self, record: dict):
+        name = record.get("n")
+        price_rub = record.get("p", 0)
+        quantity = record.get("q", 0) or 0
+
+        if not name or price_rub <= 0:
+            self.skipped += 1
+            return
+
+        previous = self.previous
+        changes = self.changes
+        # повтор названия в одном прайсе — отдельный предмет: k-е вхождение
+        # сопоставляется k-му вхождению в предыдущем снимке
+        k = self._occurrences.get(name, 0)
+        self._occurrences[name] = k + 1
+        position, previous_doc = previous.occurrence(name, k)
+        if k == 0:
+            doc = self.name_docs.get(name)
+        else:
+            doc = previous_doc if self.index is previous.search_index else None
+        if position is not None:
+            self._matched.add(position)
+
+        if position is not None:
+            # id повтора не берётся из снимка: в старых снимках он совпадал с первым
+            item_id = previous.ids[position] if k == 0 else item_id_for(name, k)
+            image = previous.images[position]
+            if position != len(self._names) or item_id != previous.ids[position]:
+                self._in_place = False
+            if previous.stars_rate == self.stars_rate and previous.price_rub[position] == price_rub:
+                stars, usd = previous.price_stars[position], previous.price_usd[position]
+            else:
+                stars, usd = None, None
+            if stars is not None and previous.quantity[position] == quantity:
+                changes.unchanged += 1
+            else:
+                changes.repriced += 1
+                changes.changed_ids.append(item_id)
+            name = previous.names[position]
+        else:
+            item_id = item_id_for(name, k)
+            image = self.image_lookup(name)
+            name = sys.intern(name)
+            changes.added += 1
+            changes.changed_ids.append(item_id)
+            self._in_place = False
+            stars = None
+
+        if stars is None:
+            stars, usd = _price_stars(price_rub, self.stars_rate), _price_usd(price_rub)
+            self._changed.append(len(self._names))
+
+        if doc is None or doc in self._used_docs:
+            doc = self.index.add(name.lower())
+            self.name_docs.setdefault(name, doc)
+        self._used_docs.add(doc)
+
+        self._names.append(name)
+        self._ids.append(item_id)
+        self._prices.append(price_rub)
+        self._quantities.append(quantity)
+        self._images.append(image)
+        self._docs.append(doc)
+        self._stars.append(stars)
+        self._usd.append(usd)
+
+    def finish(self, timestamp: datetime | None = None) -> CatalogSnapshot:
+        changes = self.changes
+        previous = self.previous
+        matched = self._matched
+        for position in range(len(previous)):
+            if position not in matched:
+                changes.removed += 1
+                changes.removed_ids.append(previous.ids[position])
+
+        doc_positions = array('i', [-1]) * len(self.index)
+        for position, doc in enumerate(self._docs):
+            doc_positions[doc] = position
+
+        ids = array('q', self._ids)
+        price_rub = _number_array(self._prices)
+        return CatalogSnapshot(
+            self._names,
+            ids,
+            price_rub,
+            array('q', self._quantities),
+            self._images,
+            self.stars_rate,
+            timestamp,
+            search=(self.index, self.name_docs, doc_positions),
+            changes=changes,
+            derived=self._derive(ids, price_rub)
+        )
+
+    def _derive(self, ids: array, price_rub: array) -> tuple:
+        """Производные колонки нового снимка с переносом неизменённого из предыдущего"""
+        previous = self.previous
+        changed = self._changed
+        price_stars, price_usd = array('q', self._stars), array('d', self._usd)
+        in_place = self._in_place and len(previous) == len(ids)
+        # при смене курса или массовой переоценке досортировка не выигрывает
+        if not in_place or len(changed) * 8 > len(ids):
+            return (price_stars, price_usd) + _indexes(ids, price_rub, price_stars)
+
+        if not changed:
+            return (price_stars, price_usd, previous._positions_by_id, previous._price_order,
+                    previous._sorted_prices, previous._gift_positions)
+
+        # прежний порядок без переоценённых уже отсортирован; переоценённые
+        # дописываются отсортированными, и timsort сливает два прогона за O(n)
+        mask = bytearray(len(ids))
+        for position in changed:
+            mask[position] = 1
+        order = [position for position in previous._price_order if not mask[position]]
+        order.extend(sorted(changed, key=price_rub.__getitem__))
+        order.sort(key=price_rub.__getitem__)
+        price_order = array('i', order)
+
+        # новые подарки — среди прежних и переоценённых, если прежние не менялись
+        gifts = previous._gift_positions
+        if any(mask[position] for position in gifts):
+            gifts = range(len(ids))
+        else:
+            gifts = sorted(set(gifts).union(changed))
+        gift_positions = heapq.nsmallest(GIFT_POOL_SIZE, gifts, key=price_stars.__getitem__)
+
+        return (price_stars, price_usd, previous._positions_by_id, price_order,
+                _number_array([price_rub[i] for i in price_order]), gift_positions)
@@ -1,3 +1,5 @@
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from dotenv import load_dotenv
 import os
 
@@ -8,4 +10,14 @@ if OWNER_ID:
     OWNER_ID = int(OWNER_ID)
 else:
     OWNER_ID = None
-    print("OWNER_ID не указан в .env — уведомления владельцу отключены")
\ No newline at end of file
+    print("OWNER_ID не указан в .env — уведомления владельцу отключены")
+
+# Свой сервер Bot API (локальный telegram-bot-api или заглушка из benchmarks/standin.py)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+
+
+def bot_session() -> AiohttpSession | None:
+    """Сессия для Bot(...): None — стандартный api.telegram.org"""
+    if not TELEGRAM_API_URL:
+        return None
+    return AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
@@ -3,10 +3,17 @@
 import asyncio
 import json
 import os
+import time
 from dotenv import load_dotenv
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, BigInteger, select
+from sqlalchemy import (Column, Integer, String, ForeignKey, Boolean, BigInteger, DateTime, Index, JSON,
+                        select, update, exists, func, tuple_)
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.orm import declarative_base, sessionmaker, aliased
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from metrics import db_pool_checkout_seconds, db_pool_in_use, db_pool_open
+from ttl_cache import AsyncTTLCache
 
 load_dotenv()
 
@@ -20,14 +27,43 @@ if "postgresql://" in DATABASE_URL and "postgresql+asyncpg://" not in DATABASE_U
     DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://")
     print("Автоматически добавлен +asyncpg в DATABASE_URL")
 
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Пул, замеряющий ожидание соединения (включая открытие нового сверх pool_size)"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_checkout_seconds.observe(time.perf_counter() - started)
+
+
 engine = create_async_engine(
     DATABASE_URL,
     echo=False,
+    poolclass=TimedQueuePool,
     pool_size=5,
     max_overflow=10,
     pool_timeout=30
 )
 
+db_pool_in_use.func = lambda: engine.pool.checkedout()
+db_pool_open.func = lambda: engine.pool.checkedin() + engine.pool.checkedout()
+
+# Рабочая база — PostgreSQL; SQLite (sqlite+aiosqlite:///...) поддерживается для
+# нагрузочных тестов без сервера БД (benchmarks/bench_webhook.py)
+IS_SQLITE = engine.dialect.name == "sqlite"
+
+# JSONB и BIGINT-ключи в SQLite: JSON и INTEGER PRIMARY KEY (иначе нет автоинкремента)
+JSONB_TYPE = JSONB().with_variant(JSON(), "sqlite")
+ID_TYPE = BigInteger().with_variant(Integer(), "sqlite")
+
+
+def dialect_insert(model):
+    """INSERT с поддержкой ON CONFLICT для диалекта текущей базы"""
+    return sqlite_insert(model) if IS_SQLITE else pg_insert(model)
+
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 Base = declarative_base()
@@ -38,96 +74,197 @@ class User(Base):
     telegram_id = Column(BigInteger, unique=True, nullable=False)
     referred_by = Column(BigInteger, ForeignKey('users.telegram_id'), nullable=True)
     referrals = Column(Integer, default=0)
-    items_received = Column(String, default="[]")
+    items_received = Column(String, default="[]")  # устарело: предметы лежат в received_items
     steam_profile = Column(String, nullable=True)
     trade_link = Column(String, nullable=True)
     has_gift = Column(Boolean, default=False)
     gift_item = Column(String, nullable=True)
 
+class ReceivedItem(Base):
+    """Полученный пользователем предмет — строка на предмет вместо JSON в users"""
+    __tablename__ = "received_items"
+    id = Column(ID_TYPE, primary_key=True)
+    telegram_id = Column(BigInteger, ForeignKey('users.telegram_id'), nullable=False)
+    data = Column(JSONB_TYPE, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_received_items_user_time", "telegram_id", "created_at", "id"),
+    )
+
+class PurchaseJob(Base):
+    """Оплаченная покупка, которую фоновые воркеры отправляют в Xpanda"""
+    __tablename__ = "purchase_jobs"
+    id = Column(ID_TYPE, primary_key=True)
+    custom_id = Column(String, unique=True, nullable=False)  # один и тот же при всех повторах
+    telegram_id = Column(BigInteger, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    product_id = Column(String, nullable=False)
+    item = Column(JSONB_TYPE, nullable=False)
+    max_price = Column(BigInteger, nullable=False)
+    partner = Column(String, nullable=False)
+    token = Column(String, nullable=False)
+    trade_link = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending -> running -> done | failed | review
+    attempts = Column(Integer, nullable=False, default=0)
+    next_run_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    last_error = Column(String, nullable=True)
+    result = Column(JSONB_TYPE, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_purchase_jobs_ready", "status", "next_run_at"),
+    )
+
+class ProcessedUpdate(Base):
+    """update_id уже принятых апдейтов Telegram — окно дедупликации webhook"""
+    __tablename__ = "processed_updates"
+    update_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    seen_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), index=True)
+
+class ExpiringKey(Base):
+    """Ключи с истечением для ttl_store.PostgresTTLStore (кулдауны и т.п.)"""
+    __tablename__ = "expiring_keys"
+    key = Column(String, primary_key=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await _migrate_items_received(conn)
         print("База данных PostgreSQL инициализирована и таблицы созданы")
 
-async def get_user(telegram_id: int, session: AsyncSession = None) -> User | None:
-    stmt = select(User).where(User.telegram_id == telegram_id)
-    if session:
-        result = await session.execute(stmt)
-        return result.scalar_one_or_none()
+async def _migrate_items_received(conn):
+    """Одноразовый перенос users.items_received в received_items (повторно ничего не делает)"""
+    rows = (await conn.execute(
+        select(User.telegram_id, User.items_received)
+        .where(User.items_received.is_not(None), User.items_received.not_in(["", "[]"]))
+    )).all()
+    if not rows:
+        return
+
+    moved = 0
+    for telegram_id, items_received in rows:
+        try:
+            items = json.loads(items_received)
+        except ValueError:
+            print(f"[MIGRATION] Пропущен пользователь {telegram_id}: items_received не JSON")
+            continue
+        if not isinstance(items, list):
+            items = [items]
+        if items:
+            # порядок списка сохраняется в порядке id
+            await conn.execute(
+                ReceivedItem.__table__.insert(),
+                [{"telegram_id": telegram_id, "data": item} for item in items]
+            )
+        await conn.execute(
+            update(User).where(User.telegram_id == telegram_id).values(items_received="[]")
+        )
+        moved += len(items)
+    print(f"[MIGRATION] Перенесено {moved} предметов из items_received ({len(rows)} пользователей)")
+
+# Кэш пользователей для get_user без сессии. Отдаваемые объекты общие
+# для всех вызывающих — менять их нельзя, запись идёт через функции ниже,
+# и каждая из них сбрасывает кэш затронутых пользователей.
+user_cache = AsyncTTLCache(
+    ttl=float(os.getenv("USER_CACHE_TTL", 30)),
+    maxsize=int(os.getenv("USER_CACHE_SIZE", 10000))
+)
+
 
+async def _load_user(telegram_id: int) -> User | None:
     async with async_session() as sess:
-        result = await sess.execute(stmt)
+        result = await sess.execute(select(User).where(User.telegram_id == telegram_id))
         return result.scalar_one_or_none()
 
+
+async def get_user(telegram_id: int, session: AsyncSession = None, fresh: bool = False) -> User | None:
+    """fresh=True — мимо кэша: для решений о деньгах (кэш сбрасывается только в своём процессе)"""
+    if fresh:
+        return await _load_user(telegram_id)
+    if session:
+        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+        return result.scalar_one_or_none()
+
+    return await user_cache.get(telegram_id, lambda: _load_user(telegram_id))
+
 # ────────────────────────────────────────────────
 # Изменено: теперь НЕ принимает referred_by
 # ────────────────────────────────────────────────
 async def add_user(telegram_id: int) -> User:
+    # INSERT ... ON CONFLICT DO NOTHING: одновременные /start не упадут на unique
+    stmt = (
+        dialect_insert(User)
+        .values(telegram_id=telegram_id)
+        .on_conflict_do_nothing(index_elements=[User.telegram_id])
+        .returning(User)
+    )
     async with async_session() as session:
         async with session.begin():
-            stmt = select(User).where(User.telegram_id == telegram_id)
-            result = await session.execute(stmt)
-            user = result.scalar_one_or_none()
-
-            if user:
+            user = (await session.execute(stmt)).scalar_one_or_none()
+            if user is None:
                 print(f"Пользователь {telegram_id} уже существует")
-                return user
+                return await get_user(telegram_id, session)
 
-            user = User(telegram_id=telegram_id)  # referred_by остаётся None
-            session.add(user)
+        user_cache.invalidate(telegram_id)
 
         print(f"Добавлен новый пользователь: {telegram_id}")
         return user
 
 # ────────────────────────────────────────────────
-# add_referral — остаётся почти без изменений,
-# но теперь именно он отвечает за установку referred_by
+# add_referral — устанавливает referred_by и увеличивает referrals
+# пригласившего одним запросом. Возвращает (referrals, has_gift)
+# пригласившего или None, если реферал не засчитан.
 # ────────────────────────────────────────────────
-async def add_referral(referrer_telegram_id: int, invited_telegram_id: int):
+async def add_referral(referrer_telegram_id: int, invited_telegram_id: int) -> tuple[int, bool] | None:
     if referrer_telegram_id == invited_telegram_id:
         print(f"[WARNING] Самореферал {invited_telegram_id} — игнорируем")
-        return
+        return None
+
+    # Приглашённый получает referrer, только если его ещё нет и пригласивший
+    # существует; при одновременных запросах строку приглашённого обновит
+    # ровно один — остальные после блокировки увидят referred_by уже заполненным
+    inviter = aliased(User)
+    mark_invited = (
+        update(User)
+        .where(
+            User.telegram_id == invited_telegram_id,
+            User.referred_by.is_(None),
+            exists().where(inviter.telegram_id == referrer_telegram_id)
+        )
+        .values(referred_by=referrer_telegram_id)
+        .returning(User.telegram_id)
+    )
+    count_referral = (
+        update(User)
+        .where(User.telegram_id == referrer_telegram_id)
+        .values(referrals=User.referrals + 1)
+        .returning(User.referrals, User.has_gift)
+    )
 
     async with async_session() as session:
-        async with session.begin():   # ← транзакция открыта здесь
-            # Получаем пригласившего
-            stmt_inviter = select(User).where(User.telegram_id == referrer_telegram_id)
-            result_inviter = await session.execute(stmt_inviter)
-            inviter = result_inviter.scalar_one_or_none()
-
-            # Получаем приглашённого
-            stmt_invited = select(User).where(User.telegram_id == invited_telegram_id)
-            result_invited = await session.execute(stmt_invited)
-            invited = result_invited.scalar_one_or_none()
-
-            if not inviter or not invited:
-                print(f"Не найден inviter ({referrer_telegram_id}) или invited ({invited_telegram_id})")
-                return
-
-            if invited.referred_by is not None:
-                if invited.referred_by == referrer_telegram_id:
-                    print(f"[INFO] Повторное приглашение {invited_telegram_id} от {referrer_telegram_id} — игнорируем")
-                else:
-                    print(f"[WARNING] Конфликт реферала: {invited_telegram_id} уже имеет referrer {invited.referred_by}")
-                return  # в любом случае выходим — не трогаем
-
-            # ─── Основные изменения здесь ─────────────────────────────────────
-            invited.referred_by = referrer_telegram_id
-            inviter.referrals += 1
-
-            # Добавляем/обновляем объекты в сессию **до** commit
-            session.add(invited)
-            session.add(inviter)
-
-            # Можно оставить refresh, но уже после изменений
-            # await session.refresh(inviter)
-            # await session.refresh(invited)
-
-            print(f"[SUCCESS] Добавлен реферал: {invited_telegram_id} → {referrer_telegram_id}")
-            print(f"У {referrer_telegram_id} теперь referrals = {inviter.referrals} (в памяти сессии)")
-
-        # Здесь происходит commit автоматически благодаря async with session.begin()
-        # После выхода из блока транзакция коммитится
+        async with session.begin():
+            if IS_SQLITE:
+                # SQLite не умеет UPDATE внутри WITH — два запроса в одной транзакции
+                row = None
+                if (await session.execute(mark_invited)).first() is not None:
+                    row = (await session.execute(count_referral)).one_or_none()
+            else:
+                invited = mark_invited.cte("invited")
+                stmt = count_referral.where(exists().where(invited.c.telegram_id == invited_telegram_id))
+                row = (await session.execute(stmt)).one_or_none()
+
+    if row is None:
+        print(f"[INFO] Реферал {invited_telegram_id} → {referrer_telegram_id} не засчитан "
+              f"(нет пользователя или referrer уже установлен)")
+        return None
+
+    user_cache.invalidate(referrer_telegram_id, invited_telegram_id)
+    print(f"[SUCCESS] Добавлен реферал: {invited_telegram_id} → {referrer_telegram_id}")
+    print(f"У {referrer_telegram_id} теперь referrals = {row.referrals}")
+    return row.referrals, row.has_gift
 
 async def update_steam(telegram_id: int, profile: str, trade_link: str):
     async with async_session() as session:
@@ -141,4 +278,80 @@ async def update_steam(telegram_id: int, profile: str, trade_link: str):
                 user.trade_link = trade_link
                 print(f"Обновлены Steam данные для {telegram_id}")
             else:
-                print(f"Пользователь {telegram_id} не найден")
\ No newline at end of file
+                print(f"Пользователь {telegram_id} не найден")
+
+    user_cache.invalidate(telegram_id)
+
+
+async def claim_gift(telegram_id: int, min_referrals: int) -> bool:
+    """
+    Атомарно отмечает подарок выданным до покупки: из одновременных
+    запросов (в том числе из разных процессов) True получит только один
+    """
+    async with async_session() as session:
+        async with session.begin():
+            claimed = (await session.execute(
+                update(User)
+                .where(
+                    User.telegram_id == telegram_id,
+                    User.has_gift.is_not(True),
+                    User.referrals >= min_referrals
+                )
+                .values(has_gift=True)
+                .returning(User.telegram_id)
+            )).first()
+
+    user_cache.invalidate(telegram_id)
+    return claimed is not None
+
+
+async def release_gift(telegram_id: int):
+    """Откат claim_gift, если покупка подарка не удалась"""
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                update(User).where(User.telegram_id == telegram_id).values(has_gift=False)
+            )
+
+    user_cache.invalidate(telegram_id)
+
+
+async def add_received_item(telegram_id: int, data: dict):
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                ReceivedItem.__table__.insert().values(telegram_id=telegram_id, data=data)
+            )
+
+
+async def get_received_items(telegram_id: int, limit: int = 20,
+                             before: int | None = None) -> tuple[list[dict], int | None]:
+    """
+    Страница полученных предметов, новые первыми. before — курсор (id
+    последнего предмета предыдущей страницы). Возвращает (предметы,
+    курсор следующей страницы или None). Стоимость зависит только от
+    limit: запрос идёт по индексу (telegram_id, created_at, id).
+    """
+    stmt = (
+        select(ReceivedItem.id, ReceivedItem.data, ReceivedItem.created_at)
+        .where(ReceivedItem.telegram_id == telegram_id)
+        .order_by(ReceivedItem.created_at.desc(), ReceivedItem.id.desc())
+        .limit(limit + 1)
+    )
+    if before is not None:
+        anchor = (
+            select(ReceivedItem.created_at, ReceivedItem.id)
+            .where(ReceivedItem.id == before, ReceivedItem.telegram_id == telegram_id)
+            .subquery()
+        )
+        stmt = stmt.where(
+            tuple_(ReceivedItem.created_at, ReceivedItem.id) < tuple_(anchor.c.created_at, anchor.c.id)
+        )
+
+    async with async_session() as session:
+        rows = (await session.execute(stmt)).all()
+
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    items = [{**row.data, "received_at": row.created_at.isoformat()} if isinstance(row.data, dict) else row.data
+             for row in rows[:limit]]
+    return items, next_cursor
\ No newline at end of file
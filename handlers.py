@@ -1,31 +1,19 @@
 # handlers.py
 
-import hashlib
-import hmac
 import json
 import random
-import aiohttp
 import os
 import uuid
 from datetime import datetime
 from aiogram import Dispatcher, types
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from database import add_user, add_referral, update_steam, async_session, User, get_user
+from database import add_user, add_referral, update_steam, get_user, claim_gift, release_gift
+from purchases import enqueue_purchase, purchase_custom_id, record_received_item
 from keyboards import main_menu
 from cache import cache
-from config import OWNER_ID
-from aiogram import Bot
-
-XPANDA_BASE_URL = "https://p2p.xpanda.pro/api/v1"
-XPANDA_API_KEY = os.getenv('XPANDA_API_KEY')
-XPANDA_SECRET = os.getenv('XPANDA_SECRET', '')
-BOT_TOKEN = os.getenv('BOT_TOKEN')
-bot = Bot(token=BOT_TOKEN)
-xpanda_headers = {
-    "Authorization": XPANDA_API_KEY,
-    "Content-Type": "application/json"
-}
+from xpanda import xpanda, XpandaError
+from notifier import notifier
 
 
 def parse_trade_link(trade_link: str) -> dict | None:
@@ -54,17 +42,14 @@ def parse_trade_link(trade_link: str) -> dict | None:
 
 async def get_actual_balance():
     """Получает актуальный баланс напрямую с API"""
-    url = f"{XPANDA_BASE_URL}/balance/"
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=xpanda_headers, timeout=10) as resp:
-                if resp.status != 200:
-                    print(f"[BALANCE CHECK] Ошибка статуса: {resp.status}")
-                    return None
-                data = await resp.json()
-                available = data.get("available", 0)
-                print(f"[BALANCE CHECK] Доступно: {available} руб")
-                return available
+        balance = await xpanda.get_balance(timeout=10)
+        available = balance["available"]
+        print(f"[BALANCE CHECK] Доступно: {available} руб")
+        return available
+    except XpandaError as e:
+        print(f"[BALANCE CHECK] Ошибка статуса: {e.status}")
+        return None
     except Exception as e:
         print(f"[BALANCE CHECK ERROR] {type(e).__name__}: {str(e)}")
         return None
@@ -86,20 +71,20 @@ async def start_handler(message: types.Message):
     if ref_id and is_new_user:
         try:
             print(f"[REFERRAL] Пытаемся добавить реферал {message.from_user.id} → от {ref_id}")
-            await add_referral(ref_id, message.from_user.id)
+            inviter = await add_referral(ref_id, message.from_user.id)
             print("[REFERRAL] add_referral прошёл без исключения")
 
-            inviter = await get_user(ref_id)
             if inviter:
-                print(f"[REFERRAL] У инвайтера {ref_id} referrals теперь = {inviter.referrals}")
-                if inviter.referrals == 3 and not inviter.has_gift:
+                referrals, has_gift = inviter
+                print(f"[REFERRAL] У инвайтера {ref_id} referrals теперь = {referrals}")
+                if referrals == 3 and not has_gift:
                     print("[REFERRAL] Отправляем уведомление о подарке инвайтеру")
                     markup = InlineKeyboardMarkup(inline_keyboard=[[
                         InlineKeyboardButton(text="Забрать подарок 🎁", callback_data="claim_gift")
                     ]])
                     await message.bot.send_message(
                         ref_id,
-                        f"🎉 Поздравляем! Один из ваших рефералов присоединился — у вас теперь {inviter.referrals} рефералов!\n"
+                        f"🎉 Поздравляем! Один из ваших рефералов присоединился — у вас теперь {referrals} рефералов!\n"
                         f"Вы получаете подарок. Нажмите кнопку ниже, чтобы получить рандомный дешёвый скин в Steam.",
                         reply_markup=markup
                     )
@@ -114,7 +99,7 @@ async def start_handler(message: types.Message):
 
 
 async def claim_gift_callback(callback: types.CallbackQuery):
-    user = await get_user(callback.from_user.id)
+    user = await get_user(callback.from_user.id, fresh=True)
     if not user:
         await callback.answer("Пользователь не найден", show_alert=True)
         return
@@ -136,7 +121,7 @@ async def claim_gift_callback(callback: types.CallbackQuery):
         await callback.answer("Неверный формат trade-ссылки. Проверьте ссылку в профиле!", show_alert=True)
         return
 
-    cheap_items = sorted(cache.all_items, key=lambda x: x["price_stars"])[:int(os.getenv("CHEAP_ITEMS_COUNT", 5))]
+    cheap_items = cache.snapshot.cheapest(int(os.getenv("CHEAP_ITEMS_COUNT", 5)))
     if not cheap_items:
         await callback.answer("Подарков пока нет. Попробуйте позже!", show_alert=True)
         return
@@ -162,64 +147,53 @@ async def claim_gift_callback(callback: types.CallbackQuery):
 
     max_price = int(actual_price_rub * 1.1)
 
-    params = {
-        "product": gift['product_id'],
-        "partner": trade_params["partner"],
-        "token": trade_params["token"],
-        "max_price": max_price,
-        "custom_id": custom_id,
-    }
-
-    params_list = [f"{k}:{v}" for k, v in sorted(params.items()) if v is not None]
-    params_string = ';'.join(params_list)
-
-    sign = hmac.new(
-        XPANDA_SECRET.encode(),
-        params_string.encode(),
-        hashlib.sha256
-    ).hexdigest()
+    # Подарок занимается до покупки: параллельный запрос (или другой процесс) получит отказ
+    if not await claim_gift(user.telegram_id, min_referrals=3):
+        await callback.answer("Подарок уже получен!", show_alert=True)
+        return
 
-    params["sign"] = sign
+    print(f"[DEBUG GIFT] Отправка подарка: {gift['product_id']} (max_price = {max_price}, custom_id = {custom_id})")
 
-    url = f"{XPANDA_BASE_URL}/purchases/"
+    try:
+        result = await xpanda.create_purchase(
+            product=gift['product_id'],
+            partner=trade_params["partner"],
+            token=trade_params["token"],
+            max_price=max_price,
+            custom_id=custom_id
+        )
+    except XpandaError as e:
+        # Xpanda отказал — покупки нет, подарок можно запросить снова
+        await release_gift(user.telegram_id)
+        print(f"[DEBUG GIFT] Статус: {e.status}, Ответ: {e.text[:500]}...")
+        await callback.answer(f"Ошибка отправки: {e.status} — {e.text[:200]}", show_alert=True)
+        return
+    except Exception as e:
+        # таймаут или обрыв: покупка могла пройти, поэтому подарок остаётся занятым до проверки владельцем
+        await callback.answer(f"Ошибка: {str(e)}", show_alert=True)
+        notifier.notify(f"Ошибка выдачи подарка User ID: {callback.from_user.id}, custom_id: {custom_id}: "
+                        f"{str(e)}\nПодарок отмечен выданным — проверьте покупку в Xpanda", "gift")
+        return
 
-    print(f"[DEBUG GIFT] Отправка подарка на: {url}")
-    print(f"[DEBUG GIFT] Payload: {json.dumps(params, indent=2, ensure_ascii=False)}")
+    print(f"[DEBUG GIFT] Ответ: {str(result)[:500]}...")
+    try:
+        await record_received_item(user.telegram_id, gift, "gift", result.get('id'))
 
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(
-                url,
-                json=params,
-                headers=xpanda_headers,
-                timeout=30
-            ) as resp:
-                text = await resp.text()
-                print(f"[DEBUG GIFT] Статус: {resp.status}, Ответ: {text[:500]}...")
-
-                if resp.status in [200, 201]:
-                    user.has_gift = True
-                    async with async_session() as session:
-                        async with session.begin():
-                            session.add(user)
-
-                    await callback.message.edit_text(
-                        f"🎉 Подарок успешно отправлен в Steam!\n"
-                        f"**{gift['name']}** за {gift['price_stars']} ⭐\n"
-                        f"Проверьте трейд-офер в Steam."
-                    )
-                    await callback.answer("Подарок получен!", show_alert=True)
-                    await bot.send_message(OWNER_ID,
-                        f"🎁 Подарок выдан (реферальная программа)\n"
-                        f"User ID: {callback.from_user.id}\n"
-                        f"Предмет: {gift['name']}\n"
-                        f"Цена: {gift['price_rub']}"
-                    )
-                else:
-                    await callback.answer(f"Ошибка отправки: {resp.status} — {text[:200]}", show_alert=True)
-        except Exception as e:
-            await callback.answer(f"Ошибка: {str(e)}", show_alert=True)
-            await bot.send_message(OWNER_ID,f"Ошибка выдачи подарка User ID: {callback.from_user.id}: {str(e)}", show_alert=True)
+        await callback.message.edit_text(
+            f"🎉 Подарок успешно отправлен в Steam!\n"
+            f"**{gift['name']}** за {gift['price_stars']} ⭐\n"
+            f"Проверьте трейд-офер в Steam."
+        )
+        await callback.answer("Подарок получен!", show_alert=True)
+        notifier.notify(
+            f"🎁 Подарок выдан (реферальная программа)\n"
+            f"User ID: {callback.from_user.id}\n"
+            f"Предмет: {gift['name']}\n"
+            f"Цена: {gift['price_rub']}"
+        )
+    except Exception as e:
+        print(f"[DEBUG GIFT] Подарок отправлен, но ошибка после покупки: {type(e).__name__}: {str(e)}")
+        notifier.notify(f"Подарок выдан, но ошибка после покупки User ID: {callback.from_user.id}: {str(e)}", "gift")
 
 
 async def bind_steam(message: types.Message):
@@ -241,7 +215,7 @@ async def successful_payment_handler(message: types.Message):
     product_id = payload.get('product_id')
     user_id = payload['user_id']
 
-    user = await get_user(user_id)
+    user = await get_user(user_id, fresh=True)
     if not user or not user.trade_link:
         await message.answer("Ошибка: Trade link не привязан в профиле!")
         return
@@ -251,11 +225,14 @@ async def successful_payment_handler(message: types.Message):
         await message.answer("Ошибка: Неверный формат trade-ссылки. Проверьте ссылку в профиле.")
         return
 
-    actual_price_rub = None
-    for item in cache.all_items:
-        if item.get("product_id") == product_id or item.get("name") == product_id:
-            actual_price_rub = item.get("price_rub")
-            break
+    # по id — именно оплаченный повтор названия; если его уже нет, любой с тем же product_id
+    try:
+        item = cache.get_item(int(item_id))
+    except (TypeError, ValueError):
+        item = None
+    if item is None or item["product_id"] != product_id:
+        item = cache.get_item_by_product_id(product_id)
+    actual_price_rub = item["price_rub"] if item else None
 
     if actual_price_rub is None:
         await message.answer("Ошибка: Не удалось найти актуальную цену предмета. Попробуйте позже.")
@@ -263,62 +240,27 @@ async def successful_payment_handler(message: types.Message):
 
     max_price = int(actual_price_rub * 1.1)
 
-    params = {
-        "product": product_id,
-        "partner": trade_params["partner"],
-        "token": trade_params["token"],
-        "max_price": max_price,
-        "custom_id": f"purchase_{user.telegram_id}_{uuid.uuid4().hex[:8]}",
-    }
-
-    params_list = [f"{k}:{v}" for k, v in sorted(params.items()) if v is not None]
-    params_string = ';'.join(params_list)
-
-    sign = hmac.new(
-        XPANDA_SECRET.encode(),
-        params_string.encode(),
-        hashlib.sha256
-    ).hexdigest()
-
-    params["sign"] = sign
-
-    url = f"{XPANDA_BASE_URL}/purchases/"
+    # Покупка выполняется фоновыми воркерами (purchases.py): здесь только запись задачи
+    custom_id = purchase_custom_id(user.telegram_id, message.successful_payment.telegram_payment_charge_id)
 
-    print(f"[DEBUG PAY] Отправка на: {url}")
-    print(f"[DEBUG PAY] Payload: {json.dumps(params, indent=2, ensure_ascii=False)}")
+    print(f"[DEBUG PAY] В очередь: {product_id} (custom_id = {custom_id})")
     print(f"[DEBUG PAY] Использована цена: {actual_price_rub} руб (max_price = {max_price})")
 
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(
-                url,
-                json=params,
-                headers=xpanda_headers,
-                timeout=30
-            ) as resp:
-                text = await resp.text()
-                print(f"[DEBUG PAY] Статус: {resp.status}, Ответ: {text[:500]}...")
-
-                if resp.status in [200, 201]:
-                    result = json.loads(text)
-                    await message.answer(
-                        f"⭐ Оплата прошла успешно! Предмет отправлен в трейд.\n"
-                        f"ID сделки: {result.get('id', 'неизвестно')}\n"
-                        f"Проверьте Steam: {user.trade_link}"
-                    )
-                    await bot.send_message(OWNER_ID,
-                        f"💰 УСПЕШНАЯ ПРОДАЖА\n"
-                        f"User ID: {user_id}\n"
-                        f"Предмет: {product_id}\n"
-                        f"Сумма: {actual_price_rub}\n"
-                        f"Trade link: {user.trade_link}"
-                    )
-                else:
-                    await message.answer(f"Оплата прошла, но ошибка отправки скина: {resp.status} — {text[:300]}")
-        except Exception as e:
-            await message.answer(f"Ошибка связи с маркетплейсом: {str(e)}")
-            print(f"[ERROR PAY] {type(e).__name__}: {str(e)}")
-            await bot.send_message(OWNER_ID,f"❌ Ошибка после оплаты\nUser: {user_id}\nПредмет: {product_id}\nОшибка: {str(e)}")
+    try:
+        queued = await enqueue_purchase(custom_id, user.telegram_id, message.chat.id, item,
+                                        max_price, trade_params, user.trade_link)
+        if not queued:
+            print(f"[DEBUG PAY] Повторная доставка платежа {custom_id} — задача уже есть")
+            return
+
+        await message.answer(
+            "⭐ Оплата прошла успешно! Предмет отправляется в трейд — "
+            "пришлём сообщение, как только сделка будет создана."
+        )
+    except Exception as e:
+        await message.answer(f"Оплата прошла, но не удалось поставить покупку в очередь: {str(e)}")
+        print(f"[ERROR PAY] {type(e).__name__}: {str(e)}")
+        notifier.notify(f"❌ Ошибка после оплаты\nUser: {user_id}\nПредмет: {product_id}\nОшибка: {str(e)}", "payment")
 
 
 def register_handlers(dp: Dispatcher):
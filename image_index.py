@@ -0,0 +1,166 @@
+# image_index.py — быстрый поиск картинок предметов по skins/crates/stickers
+
+import json
+import os
+import pickle
+from search_index import NgramIndex
+
+PLACEHOLDER_IMAGE = "https://via.placeholder.com/80x60?text={}"
+
+CATALOG_FILES = {
+    "skins": "data/skins.json",
+    "crates": "data/crates.json",
+    "stickers": "data/stickers.json",
+}
+# Готовый ImageIndex; пересобирается, когда меняется любой из CATALOG_FILES
+IMAGE_INDEX_CACHE = os.getenv("IMAGE_INDEX_CACHE", "data/image_index.pickle")
+_ARTIFACT_FORMAT = 1
+
+
+def normalize_name(name: str) -> tuple[str, str]:
+    """Возвращает (name_lower, cleaned_name) — как их сравнивал get_skin_image"""
+    name_lower = name.lower().strip()
+    cleaned_name = name_lower.replace('stattrak™ ', '').split('(')[0].strip()
+    cleaned_name = cleaned_name.replace('souvenir ', '').split('(')[0].strip()
+    return name_lower, cleaned_name
+
+
+def placeholder_image(name: str) -> str:
+    return PLACEHOLDER_IMAGE.format(name[:20].replace(' ', '+'))
+
+
+class _Catalog:
+    """Один каталог: записи с картинкой в исходном порядке + индексы по ним"""
+
+    def __init__(self, entries: list, fields: tuple):
+        self.images = []
+        exact = {}
+        texts = []
+
+        for entry in entries:
+            image = entry.get('image')
+            if not image:
+                # записи без картинки get_skin_image всё равно пропускал
+                continue
+            values = [(entry.get(field) or '').lower() for field in fields]
+            position = len(self.images)
+            self.images.append(image)
+            for value in values:
+                exact.setdefault(value, position)
+            # \x00 не встречается в названиях, поэтому подстрока запроса
+            # не может «склеить» два поля записи
+            texts.append('\x00'.join(values))
+
+        self.exact = exact
+        self.index = NgramIndex(texts)
+
+    def first(self, *queries: str, exact: str | None = None) -> int | None:
+        """Первая запись, где одно из полей равно exact или содержит любой из queries"""
+        best = self.exact.get(exact) if exact is not None else None
+        for query in queries:
+            position = self.index.first(query, stop=best)
+            if position is not None:
+                best = position
+        return best
+
+
+class ImageIndex:
+    """
+    Предвычисленный индекс для get_skin_image.
+
+    Приоритет совпадений тот же, что у прежнего линейного поиска:
+    сначала скины, затем кейсы, затем стикеры, внутри каталога — первая
+    подходящая запись. Результат запоминается по имени, так что при
+    повторных обновлениях кэша одинаковые предметы не ищутся заново.
+    """
+
+    MEMO_LIMIT = 200_000
+
+    def __init__(self, skins: list, crates: list, stickers: list):
+        self.skins = _Catalog(skins, ('name', 'market_hash_name'))
+        self.crates = _Catalog(crates, ('name',))
+        self.stickers = _Catalog(stickers, ('name',))
+        self._memo = {}
+
+    def lookup(self, name: str) -> str:
+        image = self._memo.get(name)
+        if image is not None:
+            return image
+
+        image = self._find(name)
+        if len(self._memo) >= self.MEMO_LIMIT:
+            self._memo.clear()
+        self._memo[name] = image
+        return image
+
+    def _find(self, name: str) -> str:
+        name_lower, cleaned_name = normalize_name(name)
+
+        position = self.skins.first(cleaned_name, exact=cleaned_name)
+        if position is not None:
+            return self.skins.images[position]
+
+        position = self.crates.first(cleaned_name, exact=name_lower)
+        if position is not None:
+            return self.crates.images[position]
+
+        position = self.stickers.first(cleaned_name, name_lower)
+        if position is not None:
+            return self.stickers.images[position]
+
+        return placeholder_image(name)
+
+
+
+def _source_key(paths: dict) -> tuple:
+    key = [_ARTIFACT_FORMAT]
+    for name, path in sorted(paths.items()):
+        try:
+            stat = os.stat(path)
+            key.append((name, path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            key.append((name, path, None, None))
+    return tuple(key)
+
+
+def _load_json(path: str) -> list:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print(f"{os.path.basename(path)} не найден")
+        return []
+
+
+def load_image_index(paths: dict = CATALOG_FILES, artifact: str = IMAGE_INDEX_CACHE) -> ImageIndex:
+    """
+    ImageIndex из готового артефакта, если исходные JSON не менялись
+    (сверяются mtime и размер), иначе — сборка из JSON и запись артефакта.
+    """
+    key = _source_key(paths)
+    try:
+        with open(artifact, 'rb') as f:
+            stored_key, index = pickle.load(f)
+        if stored_key == key:
+            return index
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"[IMAGES] Артефакт {artifact} не читается ({type(e).__name__}) — пересобираем")
+
+    index = ImageIndex(_load_json(paths["skins"]), _load_json(paths["crates"]), _load_json(paths["stickers"]))
+    try:
+        os.makedirs(os.path.dirname(artifact) or ".", exist_ok=True)
+        tmp_path = f"{artifact}.tmp.{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((key, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, artifact)
+    except OSError as e:
+        print(f"[IMAGES] Не удалось сохранить {artifact}: {str(e)}")
+    return index
+
+
+if __name__ == "__main__":
+    # Предварительная сборка артефакта (например, при сборке образа)
+    load_image_index()
+    print(f"[IMAGES] Артефакт готов: {IMAGE_INDEX_CACHE}")
\ No newline at end of file
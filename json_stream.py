@@ -0,0 +1,87 @@
+# json_stream.py — потоковый разбор массива "items" из ответа /items/prices/
+
+import codecs
+import json
+import re
+
+_ITEMS_KEY = re.compile(r'"items"\s*:\s*')
+_WHITESPACE = " \t\r\n"
+
+
+class ItemsArrayParser:
+    """
+    Инкрементальный парсер JSON-объекта вида {"items": [ {...}, {...} ], ...}.
+
+    Байты подаются кусками через feed(); каждый вызов возвращает записи
+    массива, которые уже пришли целиком. В памяти держится только
+    недоразобранный хвост, а не всё тело ответа.
+
+    Ключ ищется по тексту, поэтому строка '"items":' внутри значения,
+    стоящего раньше массива, спутает парсер — в ответе Xpanda таких нет.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._state = "seek"  # seek -> array -> done
+        self.count = 0
+
+    def feed(self, chunk: bytes) -> list:
+        if self._state == "done":
+            return []
+        self._buffer += self._decoder.decode(chunk)
+        records = []
+
+        if self._state == "seek":
+            match = _ITEMS_KEY.search(self._buffer)
+            if match is None:
+                # ключ мог разрезаться между кусками — оставляем короткий хвост
+                self._buffer = self._buffer[-32:]
+                return records
+            rest = self._buffer[match.end():]
+            if not rest:
+                self._buffer = self._buffer[match.start():]
+                return records
+            if rest[0] != "[":
+                raise ValueError("'items' не список")
+            self._buffer = rest[1:]
+            self._state = "array"
+
+        if self._state == "array":
+            records = self._parse_elements()
+        return records
+
+    def _parse_elements(self) -> list:
+        buffer = self._buffer
+        size = len(buffer)
+        position = 0
+        records = []
+
+        while position < size:
+            char = buffer[position]
+            if char in _WHITESPACE or char == ",":
+                position += 1
+                continue
+            if char == "]":
+                self._state = "done"
+                position += 1
+                break
+            try:
+                record, end = self._json.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break  # элемент пришёл не полностью — ждём следующий кусок
+            if end >= size:
+                break  # число на границе куска могло оборваться — дочитаем
+            records.append(record)
+            position = end
+
+        self._buffer = buffer[position:]
+        self.count += len(records)
+        return records
+
+    def close(self):
+        """Проверяет, что массив закрыт; если ключа "items" не было — это пустой прайс"""
+        self._buffer += self._decoder.decode(b"", final=True)
+        if self._state == "array":
+            raise ValueError(f"Ответ оборвался внутри 'items' после {self.count} записей")
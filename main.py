@@ -1,19 +1,33 @@
 # main.py — полный, с правильным PORT
 
+import time
+
+BOOT_STARTED = time.perf_counter()  # до импорта приложения: в замер входят и импорты
+
 import asyncio
 import uvicorn
 import os
 from app import app
 from cache import cache
 from database import init_db
+from shared_catalog import SharedCatalog
 
 async def main():
     await init_db()
     print("База данных инициализирована")
 
-    asyncio.create_task(cache.update())
+    # Сохранённый снимок отдаётся сразу (stale), пока идёт первый опрос Xpanda
+    await cache.warm_start()
+
+    if os.getenv("CATALOG_MODE", "local") == "shared":
+        # Xpanda опрашивает один процесс, остальные берут его снимок из файла
+        catalog_task = asyncio.create_task(SharedCatalog(cache).run())
+    else:
+        catalog_task = asyncio.create_task(cache.update())
 
     port = int(os.getenv("PORT", 8000))  # Railway требует PORT
+    print(f"[STARTUP] Готово к запуску сервера за {time.perf_counter() - BOOT_STARTED:.2f} с "
+          f"(кэш: {len(cache.snapshot)} предметов{', stale' if cache.stale else ''})")
     print(f"Запуск сервера на порту {port}")
 
     config = uvicorn.Config(
@@ -25,5 +39,9 @@ async def main():
     server = uvicorn.Server(config)
     await server.serve()
 
+    # в shared-режиме отмена отпускает блокировку ведущего
+    catalog_task.cancel()
+    await asyncio.gather(catalog_task, return_exceptions=True)
+
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
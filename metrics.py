@@ -0,0 +1,179 @@
+# metrics.py — реестр метрик в текстовом формате Prometheus (без внешних зависимостей)
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Границы по умолчанию (сек): от быстрых обработчиков до полного прайса
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+                for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Значение задаётся set() или вычисляется func() в момент чтения /metrics"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), func=None):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+        self.func = func
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def _samples(self) -> list[str]:
+        if self.func is not None:
+            try:
+                return [f"{self.name} {_number(self.func())}"]
+            except Exception:
+                return []
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+                for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # key -> [счётчики по корзинам..., сумма, количество]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: tuple = (), func=None) -> Gauge:
+        return self._add(Gauge(name, help, labelnames, func))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Общий реестр процесса; метрики объявлены здесь, чтобы их список был в одном месте
+registry = Registry()
+
+xpanda_request_seconds = registry.histogram(
+    "xpanda_request_seconds", "Длительность запросов к Xpanda", ("endpoint",))
+xpanda_requests_total = registry.counter(
+    "xpanda_requests_total", "Запросы к Xpanda по результату", ("endpoint", "status"))
+
+cache_refresh_seconds = registry.histogram(
+    "cache_refresh_seconds", "Длительность обновления прайса (загрузка + снимок)", ("result",),
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 120))
+cache_items = registry.gauge("cache_items", "Предметов в текущем снимке")
+cache_age_seconds = registry.gauge("cache_age_seconds", "Возраст текущего снимка")
+
+api_items_seconds = registry.histogram(
+    "api_items_seconds", "Длительность /api/items", ("search", "balance_check", "status"))
+
+webhook_update_seconds = registry.histogram(
+    "webhook_update_seconds", "Обработка апдейта Telegram диспетчером", ("type",))
+
+db_pool_checkout_seconds = registry.histogram(
+    "db_pool_checkout_seconds", "Ожидание соединения из пула SQLAlchemy",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+db_pool_in_use = registry.gauge("db_pool_in_use", "Соединений пула, выданных сейчас")
+db_pool_open = registry.gauge("db_pool_open", "Соединений пула, открытых сейчас (выданные + свободные)")
+
+invoices_total = registry.counter("invoices_total", "Запросы /api/create_invoice по результату", ("result",))
+purchases_total = registry.counter("purchases_total", "Попытки покупок в Xpanda по результату", ("result",))
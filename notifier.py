@@ -0,0 +1,142 @@
+# notifier.py — уведомления владельцу: очередь, склейка однотипных ошибок, лимит частоты
+
+import asyncio
+import os
+import time
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from config import OWNER_ID, bot_session
+
+BOT_TOKEN = os.getenv('BOT_TOKEN')
+bot = Bot(token=BOT_TOKEN, session=bot_session())
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OwnerNotifier:
+    """
+    Отправка сообщений владельцу из фоновой задачи.
+
+    notify() не ждёт Telegram: текст кладётся в очередь, и вызывающий код
+    продолжает работу. Сообщения с category склеиваются: первое в окне
+    window уходит сразу, остальные только считаются, а по окончании окна
+    приходит одна сводка «ещё N за последние M мин» с последним текстом.
+    Отправка ограничена token bucket — Telegram разрешает около одного
+    сообщения в секунду в один чат.
+    """
+
+    def __init__(self, chat_id: int | None = OWNER_ID):
+        self.chat_id = chat_id
+        self.window = float(os.getenv("NOTIFY_COALESCE_WINDOW", 300))
+        self.bucket = TokenBucket(rate=float(os.getenv("NOTIFY_RATE", 1)),
+                                  capacity=float(os.getenv("NOTIFY_BURST", 3)))
+        self._queue = asyncio.Queue(maxsize=int(os.getenv("NOTIFY_QUEUE_SIZE", 1000)))
+        self._categories = {}  # category -> [конец окна, сколько подавлено, последний текст]
+        self._task = None
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def notify(self, text: str, category: str | None = None):
+        if self.chat_id is None:
+            return
+        if category is not None:
+            now = time.monotonic()
+            state = self._categories.get(category)
+            if state is not None and now < state[0]:
+                state[1] += 1
+                state[2] = text
+                self.coalesced += 1
+                return
+            self._categories[category] = [now + self.window, 0, text]
+        self._put(text)
+
+    def _put(self, text: str):
+        try:
+            self._queue.put_nowait(text)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def _flush_windows(self):
+        """Сводки по категориям, у которых закончилось окно"""
+        now = time.monotonic()
+        for category, state in list(self._categories.items()):
+            if now < state[0]:
+                continue
+            if not state[1]:
+                del self._categories[category]
+                continue
+            self._put(f"⚠️ {category}: ещё {state[1]} за последние {self.window / 60:g} мин\nПоследнее:\n{state[2]}")
+            # ошибки продолжаются — следующая сводка через окно
+            self._categories[category] = [now + self.window, 0, state[2]]
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5):
+        """Досылает очередь (не дольше timeout) и останавливает отправку"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"[NOTIFY] Не отправлено при остановке: {self._queue.qsize()}")
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            self._flush_windows()
+            try:
+                text = await asyncio.wait_for(self._queue.get(), timeout=1)
+            except asyncio.TimeoutError:
+                continue
+            try:
+                await self._send(text)
+            finally:
+                self._queue.task_done()
+
+    async def _send(self, text: str):
+        for _ in range(3):
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(self.chat_id, text)
+                self.sent += 1
+                return
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                print(f"[NOTIFY] Ошибка отправки: {type(e).__name__}: {str(e)}")
+                return
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+        }
+
+
+# Глобальный канал уведомлений владельцу
+notifier = OwnerNotifier()
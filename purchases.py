@@ -0,0 +1,278 @@
+# purchases.py — очередь оплаченных покупок: таблица purchase_jobs + пул воркеров
+
+import asyncio
+import hashlib
+import os
+import random
+from datetime import timedelta
+from aiogram import Bot
+from sqlalchemy import select, update, or_, and_, func
+from database import async_session, PurchaseJob, add_received_item, dialect_insert
+from metrics import purchases_total
+from xpanda import xpanda, XpandaClient, XpandaError
+from notifier import notifier
+from config import bot_session
+
+BOT_TOKEN = os.getenv('BOT_TOKEN')
+bot = Bot(token=BOT_TOKEN, session=bot_session())
+
+
+def purchase_custom_id(telegram_id: int, charge_id: str) -> str:
+    """custom_id покупки из id платежа Telegram: повторная доставка того же платежа даёт тот же id"""
+    return f"purchase_{telegram_id}_{hashlib.sha256(charge_id.encode()).hexdigest()[:16]}"
+
+
+async def record_received_item(telegram_id: int, item: dict, kind: str, deal_id=None):
+    """Запись в историю профиля; её ошибка не должна ломать ответ пользователю"""
+    try:
+        await add_received_item(telegram_id, {
+            "kind": kind,
+            "product_id": item["product_id"],
+            "name": item["name"],
+            "image": item["image"],
+            "price_stars": item["price_stars"],
+            "price_rub": item["price_rub"],
+            "deal_id": deal_id
+        })
+    except Exception as e:
+        print(f"[HISTORY ERROR] {telegram_id}: {type(e).__name__}: {str(e)}")
+
+
+async def enqueue_purchase(custom_id: str, telegram_id: int, chat_id: int, item: dict,
+                           max_price: int, trade_params: dict, trade_link: str) -> bool:
+    """Ставит покупку в очередь; False — задача с таким custom_id уже есть"""
+    stmt = (
+        dialect_insert(PurchaseJob)
+        .values(
+            custom_id=custom_id,
+            telegram_id=telegram_id,
+            chat_id=chat_id,
+            product_id=item["product_id"],
+            item=item,
+            max_price=max_price,
+            partner=trade_params["partner"],
+            token=trade_params["token"],
+            trade_link=trade_link
+        )
+        .on_conflict_do_nothing(index_elements=[PurchaseJob.custom_id])
+        .returning(PurchaseJob.id)
+    )
+    async with async_session() as session:
+        async with session.begin():
+            job_id = (await session.execute(stmt)).scalar_one_or_none()
+
+    purchases_total.inc(result="enqueued" if job_id is not None else "duplicate")
+    if job_id is not None:
+        purchase_workers.wake()
+    return job_id is not None
+
+
+class PurchaseWorkers:
+    """
+    Пул воркеров, выполняющих задачи из purchase_jobs.
+
+    Задача забирается одним UPDATE ... WHERE id = (SELECT ... FOR UPDATE
+    SKIP LOCKED), так что несколько воркеров и процессов не берут одну и
+    ту же покупку. Задача в статусе running, не обновлявшаяся дольше
+    lease, считается брошенной (процесс упал) и забирается снова — с тем
+    же custom_id, поэтому повтор не приводит к второй покупке.
+
+    Сетевые ошибки, таймауты и 5xx/408/429 повторяются с экспоненциальной
+    задержкой, остальные ответы Xpanda — окончательная ошибка. Если исход
+    неизвестен (была более ранняя попытка или ошибка не ответ Xpanda),
+    покупка могла пройти — задача уходит в review на ручную проверку.
+    """
+
+    BACKOFF_BASE = 5
+    BACKOFF_CAP = 300
+
+    def __init__(self):
+        self.concurrency = int(os.getenv("PURCHASE_WORKERS", 4))
+        self.max_attempts = int(os.getenv("PURCHASE_MAX_ATTEMPTS", 6))
+        self.poll_interval = float(os.getenv("PURCHASE_POLL_INTERVAL", 5))
+        self.lease = timedelta(seconds=XpandaClient.TIMEOUTS["purchases"] * 4)
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    def start(self):
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.concurrency)]
+        print(f"[PURCHASES] Запущено воркеров: {self.concurrency}")
+
+    async def stop(self, timeout: float = XpandaClient.TIMEOUTS["purchases"] + 5):
+        """Даёт начатым покупкам завершиться, затем отменяет воркеры"""
+        self._stopping = True
+        self._wakeup.set()
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        print("[PURCHASES] Воркеры остановлены")
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _worker(self, n: int):
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                job = await self._claim()
+            except Exception as e:
+                print(f"[PURCHASES] Воркер {n}: ошибка выборки задачи: {type(e).__name__}: {str(e)}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(job)
+
+    async def _claim(self) -> PurchaseJob | None:
+        ready = (
+            select(PurchaseJob.id)
+            .where(or_(
+                and_(PurchaseJob.status == "pending", PurchaseJob.next_run_at <= func.now()),
+                and_(PurchaseJob.status == "running", PurchaseJob.updated_at < func.now() - self.lease)
+            ))
+            .order_by(PurchaseJob.next_run_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        stmt = (
+            update(PurchaseJob)
+            .where(PurchaseJob.id == ready)
+            .values(status="running", attempts=PurchaseJob.attempts + 1, updated_at=func.now())
+            .returning(PurchaseJob)
+            .execution_options(synchronize_session=False)
+        )
+        async with async_session() as session:
+            async with session.begin():
+                return (await session.execute(stmt)).scalar_one_or_none()
+
+    async def _set(self, job: PurchaseJob, **values):
+        async with async_session() as session:
+            async with session.begin():
+                await session.execute(
+                    update(PurchaseJob)
+                    .where(PurchaseJob.id == job.id)
+                    .values(updated_at=func.now(), **values)
+                    .execution_options(synchronize_session=False)
+                )
+
+    async def _run(self, job: PurchaseJob):
+        print(f"[PURCHASES] Покупка {job.custom_id}: {job.product_id} (попытка {job.attempts}, max_price = {job.max_price})")
+        try:
+            result = await xpanda.create_purchase(
+                product=job.product_id,
+                partner=job.partner,
+                token=job.token,
+                max_price=job.max_price,
+                custom_id=job.custom_id
+            )
+        except XpandaError as e:
+            retry = e.status >= 500 or e.status in (408, 429)
+            rejected = not retry
+            error = f"{e.status} — {e.text[:300]}"
+        except Exception as e:
+            retry = True
+            rejected = False
+            error = f"{type(e).__name__}: {str(e)}"
+        else:
+            print(f"[PURCHASES] Ответ: {str(result)[:500]}...")
+            purchases_total.inc(result="done")
+            try:
+                await self._set(job, status="done", result=result, last_error=None)
+            except Exception as e:
+                # покупка уже прошла: задача останется running, а повтор по lease
+                # уйдёт в Xpanda с тем же custom_id
+                print(f"[PURCHASES] Не удалось отметить {job.custom_id} выполненной: {str(e)}")
+            await record_received_item(job.telegram_id, job.item, "purchase", result.get('id'))
+            await self._notify_done(job, result)
+            return
+
+        print(f"[PURCHASES] Ошибка {job.custom_id}: {error}")
+        failed = False
+        try:
+            if retry and job.attempts < self.max_attempts:
+                purchases_total.inc(result="retry")
+                delay = min(self.BACKOFF_BASE * 2 ** (job.attempts - 1), self.BACKOFF_CAP)
+                delay *= random.uniform(0.5, 1.0)
+                await self._set(job, status="pending", last_error=error,
+                                next_run_at=func.now() + timedelta(seconds=delay))
+                return
+            # отказ Xpanda на первой же попытке — покупки точно не было; иначе
+            # одна из попыток (или эта, по таймауту) могла купить предмет
+            if not rejected or job.attempts > 1:
+                purchases_total.inc(result="review")
+                await self._set(job, status="review", last_error=error)
+            else:
+                purchases_total.inc(result="failed")
+                await self._set(job, status="failed", last_error=error)
+                failed = True
+        except Exception as e:
+            print(f"[PURCHASES] Не удалось обновить задачу {job.custom_id}: {str(e)}")
+            return
+        if failed:
+            await self._notify_failed(job, error)
+        else:
+            await self._notify_review(job, error)
+
+    async def _notify_done(self, job: PurchaseJob, result: dict):
+        try:
+            await bot.send_message(job.chat_id,
+                f"✅ Предмет отправлен в трейд!\n"
+                f"ID сделки: {result.get('id', 'неизвестно')}\n"
+                f"Проверьте Steam: {job.trade_link}"
+            )
+            notifier.notify(
+                f"💰 УСПЕШНАЯ ПРОДАЖА\n"
+                f"User ID: {job.telegram_id}\n"
+                f"Предмет: {job.product_id}\n"
+                f"Сумма: {job.item['price_rub']}\n"
+                f"Trade link: {job.trade_link}"
+            )
+        except Exception as e:
+            print(f"[PURCHASES] Ошибка уведомления: {str(e)}")
+
+    async def _notify_failed(self, job: PurchaseJob, error: str):
+        try:
+            await bot.send_message(job.chat_id, f"Оплата прошла, но ошибка отправки скина: {error}")
+            notifier.notify(
+                f"❌ Ошибка после оплаты\n"
+                f"User: {job.telegram_id}\n"
+                f"Предмет: {job.product_id}\n"
+                f"custom_id: {job.custom_id}\n"
+                f"Попыток: {job.attempts}\n"
+                f"Ошибка: {error}"
+            )
+        except Exception as e:
+            print(f"[PURCHASES] Ошибка уведомления: {str(e)}")
+
+    async def _notify_review(self, job: PurchaseJob, error: str):
+        try:
+            await bot.send_message(job.chat_id,
+                "Оплата прошла, покупка проверяется вручную — мы напишем вам, как только она завершится."
+            )
+            notifier.notify(
+                f"⚠️ Покупка требует проверки\n"
+                f"User: {job.telegram_id}\n"
+                f"Предмет: {job.product_id}\n"
+                f"custom_id: {job.custom_id}\n"
+                f"Попыток: {job.attempts}\n"
+                f"Ошибка: {error}\n"
+                f"Покупка могла пройти — проверьте покупку в Xpanda по custom_id"
+            )
+        except Exception as e:
+            print(f"[PURCHASES] Ошибка уведомления: {str(e)}")
+
+
+# Глобальный пул воркеров на процесс
+purchase_workers = PurchaseWorkers()
@@ -0,0 +1,94 @@
+# scheduler.py — периодические задачи с джиттером и экспоненциальной задержкой после ошибок
+
+import asyncio
+import random
+import time
+from collections import deque
+from datetime import datetime
+
+
+class PeriodicJob:
+    """
+    Запускает func() по кругу: после успеха — через interval (± jitter),
+    после ошибки — через backoff_base, 2*backoff_base, ... но не дольше
+    backoff_cap. func возвращает False или бросает исключение при ошибке.
+    """
+
+    def __init__(self, name: str, func, interval: float, jitter: float = 0.1,
+                 backoff_base: float = 15, backoff_cap: float = 600):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.failures = 0  # ошибок подряд
+        self.next_run_at = None
+        self.last_run_at = None
+        self.last_success_at = None
+        self.last_error = None
+        self.durations = deque(maxlen=10)
+
+    def _delay(self) -> float:
+        if self.failures:
+            delay = min(self.backoff_base * 2 ** (self.failures - 1), self.backoff_cap)
+        else:
+            delay = self.interval
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def run_once(self) -> bool:
+        self.last_run_at = datetime.now()
+        started = time.perf_counter()
+        try:
+            ok = (await self.func()) is not False
+            error = None if ok else "неуспешный результат"
+        except Exception as e:
+            ok = False
+            error = f"{type(e).__name__}: {str(e)}"
+            print(f"[SCHEDULER] {self.name}: {error}")
+        self.durations.append(round(time.perf_counter() - started, 3))
+
+        if ok:
+            self.failures = 0
+            self.last_success_at = self.last_run_at
+            self.last_error = None
+        else:
+            self.failures += 1
+            self.last_error = error
+        return ok
+
+    async def run(self):
+        while True:
+            await self.run_once()
+            delay = self._delay()
+            self.next_run_at = datetime.fromtimestamp(time.time() + delay)
+            if self.failures:
+                print(f"[SCHEDULER] {self.name}: ошибка #{self.failures}, повтор через {delay:.0f} с")
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        def iso(value):
+            return value.isoformat() if value else None
+
+        return {
+            "interval": self.interval,
+            "failures": self.failures,
+            "next_run_at": iso(self.next_run_at),
+            "last_run_at": iso(self.last_run_at),
+            "last_success_at": iso(self.last_success_at),
+            "last_error": self.last_error,
+            "recent_durations": list(self.durations),
+        }
+
+
+class Scheduler:
+    """Набор PeriodicJob, работающих независимо друг от друга"""
+
+    def __init__(self, *jobs: PeriodicJob):
+        self.jobs = {job.name: job for job in jobs}
+
+    async def run(self):
+        await asyncio.gather(*(job.run() for job in self.jobs.values()))
+
+    def stats(self) -> dict:
+        return {name: job.stats() for name, job in self.jobs.items()}
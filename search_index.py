@@ -0,0 +1,79 @@
+# search_index.py — инвертированный индекс n-грамм для поиска подстроки
+
+from array import array
+
+class NgramIndex:
+    """
+    Индекс для запросов вида «query in text» по списку строк.
+
+    Для каждой n-граммы хранится отсортированный массив номеров строк,
+    в которых она встречается. Поиск берёт самый короткий из списков
+    n-грамм запроса и проверяет кандидатов обычным `in` — порядок и
+    результат совпадают с линейным проходом по списку.
+
+    Строки можно только добавлять: выданные номера не меняются, поэтому
+    индекс дополняется между обновлениями кэша, а не строится заново.
+    """
+
+    def __init__(self, texts=(), n: int = 3):
+        self.n = n
+        self.texts = []
+        self._postings = {}
+        for text in texts:
+            self.add(text)
+
+    def add(self, text: str) -> int:
+        """Добавляет строку в конец индекса и возвращает её номер"""
+        i = len(self.texts)
+        self.texts.append(text)
+        n = self.n
+        postings = self._postings
+        for gram in {text[j:j + n] for j in range(len(text) - n + 1)}:
+            posting = postings.get(gram)
+            if posting is None:
+                postings[gram] = array('i', (i,))
+            else:
+                posting.append(i)
+        return i
+
+    def __len__(self):
+        return len(self.texts)
+
+    def _candidates(self, query: str):
+        """Самый редкий posting-list запроса; None — запрос короче n-граммы"""
+        n = self.n
+        if len(query) < n:
+            return None
+
+        best = None
+        for j in range(len(query) - n + 1):
+            posting = self._postings.get(query[j:j + n])
+            if posting is None:
+                return ()
+            if best is None or len(posting) < len(best):
+                best = posting
+        return best
+
+    def search(self, query: str, stop: int | None = None) -> list[int]:
+        """Номера всех строк (< stop), содержащих query, по возрастанию"""
+        texts = self.texts
+        if stop is None:
+            stop = len(texts)
+        candidates = self._candidates(query)
+        if candidates is None:
+            return [i for i in range(min(stop, len(texts))) if query in texts[i]]
+        return [i for i in candidates if i < stop and query in texts[i]]
+
+    def first(self, query: str, stop: int | None = None) -> int | None:
+        """Номер первой строки, содержащей query (только среди номеров < stop)"""
+        texts = self.texts
+        candidates = self._candidates(query)
+        if candidates is None:
+            candidates = range(len(texts) if stop is None else min(stop, len(texts)))
+
+        for i in candidates:
+            if stop is not None and i >= stop:
+                return None
+            if query in texts[i]:
+                return i
+        return None
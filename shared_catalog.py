@@ -0,0 +1,202 @@
+# shared_catalog.py — один процесс опрашивает Xpanda, остальные читают его снимок из файла
+
+import asyncio
+import fcntl
+import os
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from database import DATABASE_URL
+from snapshot_file import read_snapshot, read_version
+
+
+class FileLeaderLock:
+    """flock на файле рядом со снимком — для процессов на одной машине"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    async def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        # дескриптор держим открытым: блокировка снимается вместе с процессом
+        self._fd = fd
+        return True
+
+    async def check(self) -> bool:
+        return self._fd is not None
+
+    async def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+class PostgresLeaderLock:
+    """
+    pg_try_advisory_lock на отдельном соединении — для процессов на разных машинах.
+
+    Соединение не из пула приложения: свой движок без пула в режиме
+    AUTOCOMMIT, чтобы соединение не висело "idle in transaction" (и не
+    попадало под idle_in_transaction_session_timeout) и не занимало пул.
+    """
+
+    KEY = 0x58504E44  # произвольная константа приложения
+
+    def __init__(self):
+        self._engine = None
+        self._conn = None
+
+    async def try_acquire(self) -> bool:
+        if self._conn is not None:
+            return True
+        if self._engine is None:
+            self._engine = create_async_engine(DATABASE_URL, poolclass=NullPool, isolation_level="AUTOCOMMIT")
+        conn = await self._engine.connect()
+        try:
+            acquired = (await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.KEY})).scalar()
+        except Exception:
+            await conn.close()
+            raise
+        if not acquired:
+            await conn.close()
+            return False
+        # блокировка живёт, пока открыто соединение
+        self._conn = conn
+        return True
+
+    async def check(self) -> bool:
+        """Соединение живо и блокировка всё ещё за ним; иначе соединение закрывается"""
+        if self._conn is None:
+            return False
+        try:
+            held = (await self._conn.execute(text(
+                "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND classid = 0 "
+                "AND objid = :key AND pid = pg_backend_pid() AND granted"
+            ), {"key": self.KEY})).scalar()
+        except Exception as e:
+            print(f"[SHARED CATALOG] Соединение с блокировкой потеряно: {type(e).__name__}: {str(e)}")
+            held = 0
+        if held:
+            return True
+        try:
+            await self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+        return False
+
+    async def release(self):
+        """Снимает блокировку сразу, не дожидаясь, пока сервер заметит закрытое соединение"""
+        if self._conn is not None:
+            try:
+                await self._conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.KEY})
+            except Exception as e:
+                print(f"[SHARED CATALOG] Ошибка снятия блокировки: {type(e).__name__}: {str(e)}")
+            try:
+                await self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+
+
+class SharedCatalog:
+    """
+    Режим CATALOG_MODE=shared.
+
+    Процесс, взявший блокировку, становится ведущим: крутит cache.update(),
+    который после каждого обновления сохраняет снимок и баланс в файл
+    cache.snapshot_path (формат — snapshot_file). Остальные раз в poll_interval сверяют версию в
+    заголовке файла и при изменении подгружают снимок в потоке и подменяют
+    его в кэше. Ведомые продолжают пытаться взять блокировку, так что при
+    падении ведущего опрос Xpanda подхватит другой процесс. Ведущий раз в
+    lock_check_interval проверяет блокировку (для postgres — что соединение
+    живо и держит её) и при потере сам становится ведомым.
+    """
+
+    def __init__(self, cache):
+        if not cache.snapshot_path:
+            raise RuntimeError("CATALOG_MODE=shared требует CATALOG_SNAPSHOT_PATH")
+        self.cache = cache
+        self.path = cache.snapshot_path
+        self.poll_interval = float(os.getenv("CATALOG_POLL_INTERVAL", 5))
+        if os.getenv("CATALOG_LOCK", "file") == "postgres":
+            self.lock = PostgresLeaderLock()
+        else:
+            self.lock = FileLeaderLock(self.path + ".lock")
+        self.lock_check_interval = float(os.getenv("CATALOG_LOCK_CHECK_INTERVAL", 30))
+        self.leader = False
+
+    async def follow(self):
+        """Подменяет снимок, если в файле появилась новая версия"""
+        version = read_version(self.path)
+        if version is None:
+            return
+        current = self.cache.snapshot
+        if version == current.version and not (current.stale and self._published_recently(current)):
+            return
+        snapshot, balance = await asyncio.to_thread(read_snapshot, self.path, self.cache.snapshot)
+        self.cache.snapshot = snapshot
+        if balance is not None:
+            self.cache.balance = balance
+        print(f"[SHARED CATALOG] Снимок {snapshot.version} загружен из файла: {len(snapshot)} предметов")
+
+    def _published_recently(self, snapshot) -> bool:
+        """
+        Тот же файл, что был прочитан при warm start, но ведущий обновлял его
+        не дольше двух интервалов назад — данные живые, stale можно снять
+        """
+        if snapshot.timestamp is None:
+            return False
+        age = (datetime.now() - snapshot.timestamp).total_seconds()
+        return age <= 2 * self.cache.CACHE_UPDATE_INTERVAL
+
+    async def lead(self):
+        """Опрашивает Xpanda, пока блокировка за процессом; при потере — перестаёт"""
+        update = asyncio.create_task(self.cache.update())
+        try:
+            while not update.done():
+                await asyncio.wait({update}, timeout=self.lock_check_interval)
+                if not update.done() and not await self.lock.check():
+                    print(f"[SHARED CATALOG] Процесс {os.getpid()} потерял блокировку — перестаёт опрашивать Xpanda")
+                    return
+            update.result()
+        finally:
+            update.cancel()
+            await asyncio.gather(update, return_exceptions=True)
+            self.leader = False
+
+    async def run(self):
+        """Работает до отмены задачи; при отмене (остановка сервера) отпускает блокировку"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        try:
+            while True:
+                try:
+                    self.leader = await self.lock.try_acquire()
+                except Exception as e:
+                    print(f"[SHARED CATALOG] Ошибка блокировки: {type(e).__name__}: {str(e)}")
+
+                if self.leader:
+                    print(f"[SHARED CATALOG] Процесс {os.getpid()} опрашивает Xpanda и публикует {self.path}")
+                    await self.lead()
+                    continue
+
+                try:
+                    await self.follow()
+                except Exception as e:
+                    print(f"[SHARED CATALOG] Ошибка чтения снимка: {type(e).__name__}: {str(e)}")
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            await self.lock.release()
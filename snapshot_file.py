@@ -0,0 +1,132 @@
+# snapshot_file.py — снимок каталога в бинарном файле для обмена между процессами
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime
+from catalog import CatalogSnapshot, reuse_search
+
+MAGIC = b"CATSNAP\x00"
+FORMAT_VERSION = 1
+
+# magic, формат, число предметов, версия снимка, тип колонки цен, длина meta
+HEADER = struct.Struct("<8sIIQc7xQ")
+
+
+def _padding(size: int) -> bytes:
+    return b"\x00" * (-size % 8)
+
+
+def _strings(values: list[str]) -> tuple[array, bytes]:
+    """Смещения (n + 1 штук) и склеенные UTF-8 байты строк"""
+    encoded = [value.encode() for value in values]
+    offsets = array('q', [0]) * (len(encoded) + 1)
+    total = 0
+    for i, data in enumerate(encoded):
+        total += len(data)
+        offsets[i + 1] = total
+    return offsets, b"".join(encoded)
+
+
+def write_snapshot(path: str, snapshot: CatalogSnapshot, balance: dict | None = None):
+    """
+    Записывает снимок атомарно: во временный файл рядом и os.replace,
+    так что читатель видит либо старый файл целиком, либо новый.
+
+    Формат: заголовок HEADER, JSON meta, затем колонки ids, price_rub,
+    quantity (по 8 байт на предмет) и строки names, images — смещения +
+    байты. Каждая секция выровнена на 8 байт, поэтому числовые колонки
+    читаются из mmap без копирования.
+    """
+    meta = json.dumps({
+        "stars_rate": snapshot.stars_rate,
+        "timestamp": snapshot.timestamp.isoformat() if snapshot.timestamp else None,
+        "balance": balance,
+    }).encode()
+    name_offsets, name_bytes = _strings(snapshot.names)
+    image_offsets, image_bytes = _strings(snapshot.images)
+
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        # колонки — array или memoryview из прочитанного файла, у обоих есть буфер
+        price_rub = memoryview(snapshot.price_rub)
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(snapshot), snapshot.version,
+                            price_rub.format.encode(), len(meta)))
+        f.write(meta + _padding(len(meta)))
+        f.write(memoryview(snapshot.ids).tobytes())
+        f.write(price_rub.tobytes())
+        f.write(memoryview(snapshot.quantity).tobytes())
+        for offsets, data in ((name_offsets, name_bytes), (image_offsets, image_bytes)):
+            f.write(offsets.tobytes())
+            f.write(data + _padding(len(data)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_version(path: str) -> int | None:
+    """Версия снимка в файле (только заголовок); None — файла нет или он чужой"""
+    try:
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) < HEADER.size:
+        return None
+    magic, fmt, _, version, _, _ = HEADER.unpack(header)
+    return version if magic == MAGIC and fmt == FORMAT_VERSION else None
+
+
+def read_snapshot(path: str, previous: CatalogSnapshot,
+                  stale: bool = False) -> tuple[CatalogSnapshot, dict | None]:
+    """
+    Снимок из файла и сохранённый вместе с ним баланс.
+
+    Числовые колонки — memoryview поверх mmap: страницы файла общие для
+    всех процессов, читающих один снимок. Строки декодируются, а поисковый
+    индекс дополняется от previous, как при обычном обновлении.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+
+    magic, fmt, count, version, price_type, meta_size = HEADER.unpack_from(view)
+    if magic != MAGIC or fmt != FORMAT_VERSION:
+        raise ValueError(f"{path}: не файл снимка каталога (формат {fmt})")
+
+    position = HEADER.size
+    meta = json.loads(bytes(view[position:position + meta_size]))
+    position += meta_size + len(_padding(meta_size))
+
+    def column(typecode: str, size: int):
+        nonlocal position
+        data = view[position:position + 8 * size].cast(typecode)
+        position += 8 * size
+        return data
+
+    def strings(intern) -> list[str]:
+        nonlocal position
+        offsets = column('q', count + 1)
+        start = position
+        values = [intern(str(view[start + offsets[i]:start + offsets[i + 1]], "utf-8"))
+                  for i in range(count)]
+        position += offsets[count] + len(_padding(offsets[count]))
+        return values
+
+    ids = column('q', count)
+    price_rub = column(price_type.decode(), count)
+    quantity = column('q', count)
+    names = strings(sys.intern)
+    images = strings(str)
+
+    timestamp = datetime.fromisoformat(meta["timestamp"]) if meta["timestamp"] else None
+    snapshot = CatalogSnapshot(
+        names, ids, price_rub, quantity, images, meta["stars_rate"], timestamp,
+        search=reuse_search(names, previous),
+        version=version,
+        stale=stale
+    )
+    return snapshot, meta.get("balance")
@@ -0,0 +1,103 @@
+from catalog import CatalogSnapshot, SnapshotBuilder, reuse_search
+from image_index import placeholder_image
+
+RECORDS = [
+    {"n": "AK-47 | Redline (Field-Tested)", "p": 1500, "q": 3},
+    {"n": "AWP | Asiimov (Field-Tested)", "p": 9000, "q": 1},
+    {"n": "AK-47 | Redline (Field-Tested)", "p": 1450, "q": 1},
+    {"n": "AK-47 | Redline (Field-Tested)", "p": 1400, "q": 2},
+]
+
+
+def build(previous, records):
+    builder = SnapshotBuilder(previous, placeholder_image)
+    for record in records:
+        builder.feed(record)
+    return builder.finish()
+
+
+def test_duplicates_unchanged_on_refresh():
+    first = build(CatalogSnapshot.empty(), RECORDS)
+    assert first.changes.added == 4
+    size = len(first.search_index)
+
+    second = build(first, RECORDS)
+    assert second.changes.added == 0
+    assert second.changes.unchanged == 4
+    assert second.changes.removed == 0
+    assert not second.changes.changed_ids
+    assert len(second.search_index) == size
+    assert list(second.ids) == list(first.ids)
+
+
+def test_duplicate_repriced_and_removed():
+    first = build(CatalogSnapshot.empty(), RECORDS)
+    records = [dict(record) for record in RECORDS[:3]]
+    records[2]["p"] = 1300
+
+    second = build(first, records)
+    assert second.changes.added == 0
+    assert second.changes.unchanged == 2
+    assert second.changes.repriced == 1
+    assert second.changes.removed_ids == [first.ids[3]]
+
+
+def test_reuse_search_keeps_duplicate_docs():
+    first = build(CatalogSnapshot.empty(), RECORDS)
+    size = len(first.search_index)
+    reuse_search(first.names, first)
+    assert len(first.search_index) == size
+
+
+def test_duplicates_have_own_ids():
+    snapshot = build(CatalogSnapshot.empty(), RECORDS)
+    assert len(set(snapshot.ids)) == len(RECORDS)
+    for position, record in enumerate(RECORDS):
+        item = snapshot.by_item_id(snapshot.ids[position])
+        assert item["product_id"] == record["n"]
+        assert item["price_rub"] == record["p"]
+
+
+def assert_derived_matches_full(snapshot):
+    from catalog import _derive
+    price_stars, price_usd, positions_by_id, price_order, sorted_prices, gifts = _derive(
+        snapshot.ids, snapshot.price_rub, snapshot.stars_rate)
+    assert snapshot.price_stars == price_stars
+    assert snapshot.price_usd == price_usd
+    assert snapshot._positions_by_id == positions_by_id
+    assert snapshot._sorted_prices == sorted_prices
+    assert sorted(snapshot._price_order) == list(range(len(snapshot)))
+    assert snapshot._gift_positions == gifts
+
+
+def test_incremental_derived_columns():
+    import random
+    rnd = random.Random(3)
+    records = [{"n": f"Item {i}", "p": rnd.randint(1, 5000), "q": 1} for i in range(300)]
+    snapshot = build(CatalogSnapshot.empty(), records)
+
+    # только переоценка на месте: индексы переносятся
+    repriced = [dict(record) for record in records]
+    for record in rnd.sample(repriced, 10):
+        record["p"] = rnd.randint(1, 5000)
+    cheapest = min(range(len(repriced)), key=lambda i: repriced[i]["p"])
+    repriced[cheapest]["p"] += 10000
+    second = build(snapshot, repriced)
+    assert second._positions_by_id is snapshot._positions_by_id
+    assert_derived_matches_full(second)
+
+    # без изменений: всё общее с предыдущим снимком
+    third = build(second, repriced)
+    assert third._price_order is second._price_order
+    assert_derived_matches_full(third)
+
+    # добавление и удаление сдвигают позиции
+    shifted = repriced[5:] + [{"n": "New item", "p": 1, "q": 1}]
+    assert_derived_matches_full(build(third, shifted))
+
+
+def test_etag_changes_with_stale():
+    snapshot = build(CatalogSnapshot.empty(), RECORDS)
+    fresh = snapshot.etag(100)
+    snapshot.stale = True
+    assert snapshot.etag(100) != fresh
@@ -0,0 +1,101 @@
+import asyncio
+import pytest
+from shared_catalog import FileLeaderLock, PostgresLeaderLock, SharedCatalog
+
+
+class FakeCache:
+    CACHE_UPDATE_INTERVAL = 300
+
+    def __init__(self, snapshot_path):
+        self.snapshot_path = snapshot_path
+
+
+def test_file_lock_mode(tmp_path, monkeypatch):
+    monkeypatch.setenv("CATALOG_LOCK", "file")
+    path = str(tmp_path / "catalog.snapshot")
+    catalog = SharedCatalog(FakeCache(path))
+    assert isinstance(catalog.lock, FileLeaderLock)
+    assert catalog.lock.path == path + ".lock"
+
+
+def test_postgres_lock_mode(tmp_path, monkeypatch):
+    monkeypatch.setenv("CATALOG_LOCK", "postgres")
+    catalog = SharedCatalog(FakeCache(str(tmp_path / "catalog.snapshot")))
+    assert isinstance(catalog.lock, PostgresLeaderLock)
+
+
+def test_requires_snapshot_path():
+    with pytest.raises(RuntimeError):
+        SharedCatalog(FakeCache(None))
+
+
+def test_file_lock_single_leader(tmp_path):
+    path = str(tmp_path / "catalog.snapshot.lock")
+    first, second = FileLeaderLock(path), FileLeaderLock(path)
+    assert asyncio.run(first.try_acquire())
+    assert not asyncio.run(second.try_acquire())
+
+
+class LostLock:
+    async def check(self) -> bool:
+        return False
+
+
+def test_leader_steps_down_when_lock_is_lost(tmp_path):
+    cache = FakeCache(str(tmp_path / "catalog.snapshot"))
+    stopped = []
+
+    async def update():
+        try:
+            await asyncio.Event().wait()
+        finally:
+            stopped.append(True)
+
+    cache.update = update
+    catalog = SharedCatalog(cache)
+    catalog.lock = LostLock()
+    catalog.lock_check_interval = 0.01
+    catalog.leader = True
+    asyncio.run(catalog.lead())
+    assert stopped and not catalog.leader
+
+
+def test_follow_clears_stale_for_same_fresh_file(tmp_path):
+    from datetime import datetime
+    from catalog import CatalogSnapshot, SnapshotBuilder
+    from image_index import placeholder_image
+    from snapshot_file import read_snapshot, write_snapshot
+
+    builder = SnapshotBuilder(CatalogSnapshot.empty(), placeholder_image)
+    builder.feed({"n": "AK-47 | Redline (Field-Tested)", "p": 1500, "q": 3})
+    snapshot = builder.finish()
+    snapshot.timestamp = datetime.now()
+    path = str(tmp_path / "catalog.snapshot")
+    write_snapshot(path, snapshot, {"available": 1})
+
+    cache = FakeCache(path)
+    cache.snapshot, cache.balance = read_snapshot(path, CatalogSnapshot.empty(), stale=True)
+    asyncio.run(SharedCatalog(cache).follow())
+    assert not cache.snapshot.stale
+    assert cache.snapshot.version == snapshot.version
+
+
+def test_run_releases_file_lock_on_cancel(tmp_path, monkeypatch):
+    monkeypatch.setenv("CATALOG_LOCK", "file")
+    cache = FakeCache(str(tmp_path / "catalog.snapshot"))
+
+    async def update():
+        await asyncio.Event().wait()
+
+    cache.update = update
+
+    async def main():
+        catalog = SharedCatalog(cache)
+        task = asyncio.create_task(catalog.run())
+        await asyncio.sleep(0.05)
+        assert catalog.leader
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return await FileLeaderLock(catalog.lock.path).try_acquire()
+
+    assert asyncio.run(main())
@@ -0,0 +1,31 @@
+import asyncio
+from aiohttp import web
+from xpanda import XpandaClient
+
+
+def test_api_key_only_on_xpanda_requests():
+    seen = {}
+
+    async def balance(request):
+        seen["balance"] = request.headers.get("Authorization")
+        return web.json_response({"total": 1, "locked": 0, "available": 1})
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/balance/", balance)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        client = XpandaClient(base_url=f"http://127.0.0.1:{port}", api_key="secret-key")
+        try:
+            assert (await client.get_balance())["available"] == 1
+            assert "Authorization" not in client.session.headers
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(main())
+    assert seen["balance"] == "secret-key"
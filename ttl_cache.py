@@ -0,0 +1,76 @@
+# ttl_cache.py — короткоживущий LRU-кэш с объединением одинаковых запросов
+
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class AsyncTTLCache:
+    """
+    Кэш результатов асинхронной загрузки по ключу.
+
+    Значение живёт ttl секунд; при переполнении вытесняется дольше всех
+    не запрашивавшийся ключ. Одновременные промахи по одному ключу ждут
+    одну и ту же загрузку (single-flight), а не повторяют её. Исключения
+    загрузчика не кэшируются — их получают все ожидавшие.
+
+    invalidate() сбрасывает ключ после записи в источник: загрузка, начатая
+    до сброса, дойдёт до своих ожидающих, но в кэш уже не попадёт.
+    """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._values = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}  # key -> Task
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get(self, key, loader):
+        """Значение по ключу; при промахе вызывает loader() — корутинную функцию"""
+        entry = self._values.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._values.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._values[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = task
+        # shield: отмена одного ожидающего не отменяет загрузку для остальных
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader):
+        task = asyncio.current_task()
+        try:
+            value = await loader()
+            if self._inflight.get(key) is task:
+                self._values[key] = (time.monotonic() + self.ttl, value)
+                self._values.move_to_end(key)
+                while len(self._values) > self.maxsize:
+                    self._values.popitem(last=False)
+            return value
+        finally:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+
+    def invalidate(self, *keys):
+        for key in keys:
+            self._values.pop(key, None)
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._values),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,103 @@
+# ttl_store.py — хранилище ключей с истечением: в памяти процесса или в Postgres
+
+import asyncio
+import heapq
+import os
+import time
+from datetime import timedelta
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from database import async_session, ExpiringKey
+
+
+class MemoryTTLStore:
+    """
+    Ключи с истечением в памяти одного процесса.
+
+    Моменты истечения лежат в куче, и при каждом обращении снимаются
+    только истёкшие ключи — словарь не растёт бесконечно. Запись в куче,
+    не совпадающая со словарём (ключ отпущен или взят заново), пропускается.
+    """
+
+    def __init__(self):
+        self._expires = {}  # key -> момент истечения
+        self._heap = []  # (момент истечения, key)
+
+    def _expire(self, now: float):
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expires, key = heapq.heappop(heap)
+            if self._expires.get(key) == expires:
+                del self._expires[key]
+
+    async def acquire(self, key: str, ttl: float) -> bool:
+        """Занимает ключ на ttl секунд; False — ключ уже занят и не истёк"""
+        now = time.monotonic()
+        self._expire(now)
+        if key in self._expires:
+            return False
+        expires = now + ttl
+        self._expires[key] = expires
+        heapq.heappush(self._heap, (expires, key))
+        return True
+
+    async def release(self, key: str):
+        self._expires.pop(key, None)
+
+    def __len__(self):
+        return len(self._expires)
+
+
+class PostgresTTLStore:
+    """
+    Ключи с истечением в таблице expiring_keys — общие для всех воркеров.
+
+    acquire — один INSERT ... ON CONFLICT DO UPDATE ... WHERE expires_at <= now():
+    строка вернётся, только если ключа не было или он истёк, поэтому из
+    одновременных запросов ключ получает ровно один. Истёкшие строки
+    периодически удаляются.
+    """
+
+    CLEANUP_INTERVAL = 300
+
+    def __init__(self):
+        self._next_cleanup = 0.0
+
+    async def acquire(self, key: str, ttl: float) -> bool:
+        now = time.monotonic()
+        if now >= self._next_cleanup:
+            self._next_cleanup = now + self.CLEANUP_INTERVAL
+            asyncio.create_task(self._cleanup())
+
+        insert = pg_insert(ExpiringKey).values(key=key, expires_at=func.now() + timedelta(seconds=ttl))
+        stmt = (
+            insert.on_conflict_do_update(
+                index_elements=[ExpiringKey.key],
+                set_={"expires_at": insert.excluded.expires_at},
+                where=ExpiringKey.expires_at <= func.now()
+            )
+            .returning(ExpiringKey.key)
+        )
+        async with async_session() as session:
+            async with session.begin():
+                return (await session.execute(stmt)).scalar_one_or_none() is not None
+
+    async def release(self, key: str):
+        async with async_session() as session:
+            async with session.begin():
+                await session.execute(delete(ExpiringKey).where(ExpiringKey.key == key))
+
+    async def _cleanup(self):
+        try:
+            async with async_session() as session:
+                async with session.begin():
+                    await session.execute(delete(ExpiringKey).where(ExpiringKey.expires_at <= func.now()))
+        except Exception as e:
+            print(f"[TTL STORE] Ошибка очистки: {type(e).__name__}: {str(e)}")
+
+
+def create_ttl_store():
+    """TTL_STORE=memory (по умолчанию, один процесс) или postgres (несколько воркеров)"""
+    if os.getenv("TTL_STORE", "memory") == "postgres":
+        return PostgresTTLStore()
+    return MemoryTTLStore()
@@ -0,0 +1,135 @@
+# update_dedupe.py — окно дедупликации апдейтов Telegram по update_id
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from database import async_session, ProcessedUpdate
+
+
+class MemoryDedupe:
+    """
+    update_id, принятые за последние window секунд (не больше maxsize).
+
+    Окно одинаково для всех записей, поэтому порядок вставки совпадает
+    с порядком истечения: устаревшие записи снимаются с начала словаря.
+    """
+
+    def __init__(self, window: float, maxsize: int):
+        self.window = window
+        self.maxsize = maxsize
+        self._seen = OrderedDict()  # update_id -> момент истечения
+        self.checks = 0
+        self.hits = 0
+
+    def _expire(self, now: float):
+        seen = self._seen
+        while seen:
+            update_id, expires = next(iter(seen.items()))
+            if expires > now and len(seen) < self.maxsize:
+                break
+            seen.popitem(last=False)
+
+    async def seen(self, update_id: int) -> bool:
+        """Отмечает апдейт; True — он уже встречался в окне"""
+        self.checks += 1
+        now = time.monotonic()
+        self._expire(now)
+        if update_id in self._seen:
+            self.hits += 1
+            return True
+        self._seen[update_id] = now + self.window
+        return False
+
+    async def forget(self, update_id: int):
+        """Снимает отметку: апдейт не был принят и Telegram пришлёт его снова"""
+        self._seen.pop(update_id, None)
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "size": len(self._seen), "checks": self.checks, "hits": self.hits}
+
+
+class PostgresDedupe(MemoryDedupe):
+    """
+    То же окно, но общее для процессов и переживающее рестарт: отметка —
+    INSERT ... ON CONFLICT DO NOTHING в processed_updates. Повторы,
+    пришедшие в этот же процесс, отсекаются памятью без запроса в базу.
+    Если база недоступна, апдейт пропускается дальше (лучше повтор, чем потеря).
+    """
+
+    CLEANUP_INTERVAL = 300
+
+    def __init__(self, window: float, maxsize: int):
+        super().__init__(window, maxsize)
+        self.db_hits = 0
+        self.errors = 0
+        self._next_cleanup = 0.0
+
+    async def seen(self, update_id: int) -> bool:
+        if await super().seen(update_id):
+            return True
+
+        now = time.monotonic()
+        if now >= self._next_cleanup:
+            self._next_cleanup = now + self.CLEANUP_INTERVAL
+            asyncio.create_task(self._cleanup())
+
+        stmt = (
+            pg_insert(ProcessedUpdate)
+            .values(update_id=update_id)
+            .on_conflict_do_nothing(index_elements=[ProcessedUpdate.update_id])
+            .returning(ProcessedUpdate.update_id)
+        )
+        try:
+            async with async_session() as session:
+                async with session.begin():
+                    inserted = (await session.execute(stmt)).scalar_one_or_none()
+        except Exception as e:
+            self.errors += 1
+            print(f"[DEDUPE] Ошибка базы: {type(e).__name__}: {str(e)}")
+            return False
+
+        if inserted is None:
+            self.hits += 1
+            self.db_hits += 1
+            return True
+        return False
+
+    async def forget(self, update_id: int):
+        await super().forget(update_id)
+        try:
+            async with async_session() as session:
+                async with session.begin():
+                    await session.execute(delete(ProcessedUpdate).where(ProcessedUpdate.update_id == update_id))
+        except Exception as e:
+            print(f"[DEDUPE] Ошибка базы: {type(e).__name__}: {str(e)}")
+
+    async def _cleanup(self):
+        try:
+            async with async_session() as session:
+                async with session.begin():
+                    result = await session.execute(
+                        delete(ProcessedUpdate)
+                        .where(ProcessedUpdate.seen_at < func.now() - timedelta(seconds=self.window))
+                    )
+            if result.rowcount:
+                print(f"[DEDUPE] Удалено устаревших update_id: {result.rowcount}")
+        except Exception as e:
+            print(f"[DEDUPE] Ошибка очистки: {type(e).__name__}: {str(e)}")
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update(backend="postgres", db_hits=self.db_hits, errors=self.errors)
+        return stats
+
+
+def create_dedupe() -> MemoryDedupe:
+    """WEBHOOK_DEDUPE=memory (по умолчанию) или postgres"""
+    window = float(os.getenv("WEBHOOK_DEDUPE_WINDOW", 3600))
+    maxsize = int(os.getenv("WEBHOOK_DEDUPE_SIZE", 100_000))
+    if os.getenv("WEBHOOK_DEDUPE", "memory") == "postgres":
+        return PostgresDedupe(window, maxsize)
+    return MemoryDedupe(window, maxsize)
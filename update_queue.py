@@ -0,0 +1,121 @@
+# update_queue.py — быстрый ответ на webhook: апдейты обрабатываются фоновыми воркерами
+
+import asyncio
+import os
+import time
+from collections import deque
+from metrics import webhook_update_seconds
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def chat_key(update) -> int:
+    """Ключ очерёдности: чат события, иначе пользователь, иначе сам апдейт"""
+    event = update.event
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else update.update_id
+
+
+class UpdateQueue:
+    """
+    Очередь апдейтов Telegram перед dp.feed_update.
+
+    Апдейты раскладываются по шардам по chat_key: у каждого шарда своя
+    ограниченная очередь и один воркер, поэтому апдейты одного чата
+    обрабатываются строго по порядку, а разные чаты — параллельно.
+    Переполненный шард не принимает апдейт (put вернёт False) — webhook
+    отвечает 503, и Telegram повторит доставку позже.
+    """
+
+    SAMPLES = 1000  # сколько последних замеров держать для перцентилей
+
+    def __init__(self, dp, bot):
+        self.dp = dp
+        self.bot = bot
+        self.enabled = os.getenv("WEBHOOK_QUEUE") == "1"
+        self.workers = int(os.getenv("WEBHOOK_WORKERS", 8))
+        self.shard_size = int(os.getenv("WEBHOOK_QUEUE_SIZE", 100))
+        self._shards = []
+        self._tasks = []
+        self.accepted = 0
+        self.rejected = 0
+        self.handled = 0
+        self.failed = 0
+        self._waits = deque(maxlen=self.SAMPLES)
+        self._durations = deque(maxlen=self.SAMPLES)
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._shards = [asyncio.Queue(maxsize=self.shard_size) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(shard)) for shard in self._shards]
+        print(f"[WEBHOOK QUEUE] Воркеров: {self.workers}, очередь на воркер: {self.shard_size}")
+
+    async def stop(self, timeout: float = 10):
+        """Дорабатывает принятые апдейты (не дольше timeout), затем останавливает воркеры"""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(shard.join() for shard in self._shards)), timeout)
+        except asyncio.TimeoutError:
+            print(f"[WEBHOOK QUEUE] Не обработано при остановке: {self.depth()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def put(self, update) -> bool:
+        shard = self._shards[chat_key(update) % len(self._shards)]
+        try:
+            shard.put_nowait((time.monotonic(), update))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+    async def _worker(self, shard: asyncio.Queue):
+        while True:
+            queued_at, update = await shard.get()
+            started = time.monotonic()
+            self._waits.append(started - queued_at)
+            try:
+                await self.dp.feed_update(self.bot, update)
+                self.handled += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"[WEBHOOK QUEUE] Ошибка апдейта {update.update_id}: {type(e).__name__}: {str(e)}")
+            finally:
+                duration = time.monotonic() - started
+                self._durations.append(duration)
+                webhook_update_seconds.observe(duration, type=update.event_type)
+                shard.task_done()
+
+    def depth(self) -> int:
+        return sum(shard.qsize() for shard in self._shards)
+
+    def stats(self) -> dict:
+        waits, durations = list(self._waits), list(self._durations)
+        return {
+            "enabled": self.enabled,
+            "workers": len(self._tasks),
+            "depth": self.depth(),
+            "max_shard_depth": max((shard.qsize() for shard in self._shards), default=0),
+            "capacity": self.shard_size * len(self._shards),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "handled": self.handled,
+            "failed": self.failed,
+            "wait_ms_p50": round(_percentile(waits, 0.5) * 1000, 2),
+            "wait_ms_p95": round(_percentile(waits, 0.95) * 1000, 2),
+            "handle_ms_p50": round(_percentile(durations, 0.5) * 1000, 2),
+            "handle_ms_p95": round(_percentile(durations, 0.95) * 1000, 2),
+        }
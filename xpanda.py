@@ -0,0 +1,165 @@
+# xpanda.py — общий HTTP-клиент Xpanda (одна долгоживущая сессия на процесс)
+
+import asyncio
+import hashlib
+import hmac
+import os
+import time
+import aiohttp
+from dotenv import load_dotenv
+from json_stream import ItemsArrayParser
+from metrics import xpanda_request_seconds, xpanda_requests_total
+
+load_dotenv()
+
+XPANDA_BASE_URL = os.getenv("XPANDA_BASE_URL", "https://p2p.xpanda.pro/api/v1")
+XPANDA_API_KEY = os.getenv('XPANDA_API_KEY')
+XPANDA_SECRET = os.getenv('XPANDA_SECRET', '')
+
+
+class XpandaError(Exception):
+    """Xpanda ответил статусом, отличным от 200/201"""
+
+    def __init__(self, status: int, text: str):
+        super().__init__(f"Xpanda error {status}: {text[:300]}")
+        self.status = status
+        self.text = text
+
+
+class XpandaClient:
+    # Таймауты (сек) по эндпоинтам: полный прайс большой, остальное — быстрые запросы
+    TIMEOUTS = {
+        "prices": 45,
+        "item_price": 10,
+        "balance": 15,
+        "purchases": 30,
+        "deals": 20,
+    }
+
+    def __init__(self, base_url: str = XPANDA_BASE_URL, api_key: str = XPANDA_API_KEY,
+                 secret: str = XPANDA_SECRET):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.secret = secret
+        self.limit = int(os.getenv("XPANDA_CONN_LIMIT", 20))
+        self.keepalive = float(os.getenv("XPANDA_KEEPALIVE", 60))
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Общая сессия; создаётся лениво, чтобы фоновые задачи могли стартовать раньше lifespan"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                keepalive_timeout=self.keepalive,
+                ttl_dns_cache=300
+            )
+            # ключ не ставится заголовком сессии, чтобы не уйти в чужой запрос
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Content-Type": "application/json"}
+            )
+        return self._session
+
+    @property
+    def auth_headers(self) -> dict:
+        """Заголовки авторизации — только для запросов к Xpanda"""
+        return {"Authorization": self.api_key or ""}
+
+    async def start(self):
+        _ = self.session
+        print(f"[XPANDA] HTTP-клиент открыт (limit={self.limit}, keepalive={self.keepalive}s)")
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            print("[XPANDA] HTTP-клиент закрыт")
+        self._session = None
+
+    async def _request(self, method: str, path: str, endpoint: str, timeout: float | None = None, **kwargs):
+        timeout = aiohttp.ClientTimeout(total=timeout or self.TIMEOUTS[endpoint])
+        started = time.perf_counter()
+        status = "error"
+        try:
+            async with self.session.request(method, self.base_url + path, timeout=timeout,
+                                            headers=self.auth_headers, **kwargs) as resp:
+                status = str(resp.status)
+                if resp.status not in (200, 201):
+                    raise XpandaError(resp.status, await resp.text())
+                data = await resp.json(content_type=None)
+                return data if data is not None else {}
+        finally:
+            xpanda_request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+            xpanda_requests_total.inc(endpoint=endpoint, status=status)
+
+    def sign(self, params: dict) -> str:
+        params_list = [f"{k}:{v}" for k, v in sorted(params.items()) if v is not None]
+        params_string = ';'.join(params_list)
+        return hmac.new(self.secret.encode(), params_string.encode(), hashlib.sha256).hexdigest()
+
+    async def get_prices(self, names: list[str] | None = None) -> list[dict]:
+        """Прайс маркета: весь или только по указанным названиям"""
+        if names:
+            data = await self._request("GET", "/items/prices/", "item_price",
+                                       params=[("names[]", name) for name in names])
+        else:
+            data = await self._request("GET", "/items/prices/", "prices")
+        return data.get("items", [])
+
+    async def iter_prices(self, chunk_size: int = 64 * 1024):
+        """
+        Полный прайс маркета потоком: отдаёт пачки записей по мере чтения
+        ответа, не буферизуя тело целиком. Куски разбираются в потоке, чтобы
+        не блокировать event loop.
+        """
+        timeout = aiohttp.ClientTimeout(total=self.TIMEOUTS["prices"])
+        parser = ItemsArrayParser()
+        # время — до конца тела ответа, включая разбор пачек вызывающим кодом
+        started = time.perf_counter()
+        status = "error"
+        try:
+            async with self.session.get(self.base_url + "/items/prices/", timeout=timeout,
+                                        headers=self.auth_headers) as resp:
+                status = str(resp.status)
+                if resp.status not in (200, 201):
+                    raise XpandaError(resp.status, await resp.text())
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    records = await asyncio.to_thread(parser.feed, chunk)
+                    if records:
+                        yield records
+            parser.close()
+        finally:
+            xpanda_request_seconds.observe(time.perf_counter() - started, endpoint="prices_stream")
+            xpanda_requests_total.inc(endpoint="prices_stream", status=status)
+
+    async def get_balance(self, timeout: float | None = None) -> dict:
+        data = await self._request("GET", "/balance/", "balance", timeout=timeout)
+        return {
+            "total": data.get("total", 0),
+            "locked": data.get("locked", 0),
+            "available": data.get("available", 0)
+        }
+
+    async def create_purchase(self, product: str, partner: str, token: str,
+                              max_price: int, custom_id: str) -> dict:
+        """Подписанная покупка предмета с отправкой в трейд"""
+        params = {
+            "product": product,
+            "partner": partner,
+            "token": token,
+            "max_price": max_price,
+            "custom_id": custom_id,
+        }
+        params["sign"] = self.sign(params)
+        return await self._request("POST", "/purchases/", "purchases", json=params)
+
+    async def create_deal(self, item_id, trade_url: str) -> dict:
+        payload = {
+            "item_id": item_id,
+            "trade_url": trade_url
+        }
+        return await self._request("POST", "/deals", "deals", json=payload)
+
+
+# Глобальный клиент на весь процесс
+xpanda = XpandaClient()